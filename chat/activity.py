@@ -0,0 +1,135 @@
+"""
+Room activity helpers for ChatConsumer.
+
+Clients report typing on every keystroke. TypingTracker turns that stream
+into state changes so the room group only hears about a user when they
+start or stop typing.
+
+PresenceDebouncer holds user_leave broadcasts for a short grace period so
+a page refresh doesn't show up as a leave followed by a join. Pending
+leaves live in this process, so before broadcasting one it asks the shared
+viewer registry whether the user came back through another worker.
+"""
+
+import asyncio
+import time
+
+from django.conf import settings
+
+from .connections import viewer_registry
+
+
+class TypingTracker:
+    """
+    Typing state of one connection.
+
+    Repeated is_typing=True reports are suppressed for `throttle` seconds,
+    and typing is cleared automatically when no report arrives for
+    `timeout` seconds, so a lost "stopped typing" frame can't leave the
+    indicator stuck.
+    """
+
+    def __init__(self, broadcast, throttle, timeout):
+        """
+        Args:
+            broadcast: Coroutine function called with the new is_typing value
+            throttle: Seconds between repeated is_typing=True broadcasts
+            timeout: Seconds of silence after which typing is cleared
+        """
+        self._broadcast = broadcast
+        self.throttle = throttle
+        self.timeout = timeout
+
+        self.is_typing = False
+        self._last_sent = 0.0
+        self._deadline = 0.0
+        self._expiry = None
+
+    async def update(self, is_typing):
+        """Handle a typing report from the client."""
+        if not is_typing:
+            await self.stop()
+            return
+
+        now = time.monotonic()
+        self._deadline = now + self.timeout
+        if self._expiry is None:
+            self._expiry = asyncio.create_task(self._expire())
+
+        if self.is_typing and now - self._last_sent < self.throttle:
+            return
+
+        self.is_typing = True
+        self._last_sent = now
+        await self._broadcast(True)
+
+    async def stop(self):
+        """Clear typing, broadcasting only if the user was typing."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+        if self.is_typing:
+            self.is_typing = False
+            await self._broadcast(False)
+
+    async def _expire(self):
+        # The deadline moves forward with every report, keep sleeping until
+        # it has really passed
+        while (delay := self._deadline - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+        self._expiry = None
+        await self.stop()
+
+
+class PresenceDebouncer:
+    """
+    Delays user_leave broadcasts per (room, user).
+
+    A leave is broadcast only if the user doesn't reconnect to the room
+    within the grace period. Reconnecting cancels the pending leave, and
+    the caller can then skip its user_join as well. A user that `registry`
+    still lists in the room (reconnected elsewhere) is not broadcast as
+    leaving either.
+    """
+
+    def __init__(self, grace_period, registry):
+        self.grace_period = grace_period
+        self.registry = registry
+        self._pending = {}
+
+    def cancel_leave(self, room_name, user_id):
+        """Cancel a pending leave. Returns True if one was pending."""
+        task = self._pending.pop((room_name, user_id), None)
+        if task is None:
+            return False
+
+        task.cancel()
+        return True
+
+    def schedule_leave(self, room_name, user_id, broadcast):
+        """
+        Broadcast a leave after the grace period unless it's cancelled.
+
+        Args:
+            room_name: The hashed room name
+            user_id: ID of the user that disconnected
+            broadcast: Coroutine function that sends the user_leave event
+        """
+        key = (room_name, user_id)
+        self.cancel_leave(*key)
+        self._pending[key] = asyncio.create_task(self._leave_later(key, broadcast))
+
+    async def _leave_later(self, key, broadcast):
+        await asyncio.sleep(self.grace_period)
+        self._pending.pop(key, None)
+
+        room_name, user_id = key
+        viewers = await self.registry.members(room_name)
+        if viewers[user_id]:
+            return
+        await broadcast()
+
+
+presence_debouncer = PresenceDebouncer(settings.CHAT_LEAVE_GRACE_PERIOD, viewer_registry)
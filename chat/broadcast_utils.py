@@ -5,16 +5,125 @@ This module provides reusable functions for broadcasting events to chat rooms
 and user notification groups, eliminating code duplication across views.
 """
 
+import logging
+import time
+from collections import defaultdict
+
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
 
+try:
+    from channels_redis.core import RedisChannelLayer
+except ImportError:  # channels_redis is only needed when REDIS_URL is set
+    RedisChannelLayer = None
+
+logger = logging.getLogger(__name__)
+
+
+# Same delivery script RedisChannelLayer.group_send uses for one group.
+# _redis_group_send_many also relies on RedisChannelLayer internals
+# (_group_key, _map_channel_keys_to_connection, consistent_hash,
+# connection) as of channels_redis 4.2.1, the version pinned in
+# requirements.txt; check both against group_send when upgrading.
+GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+
+# Notification groups per group_send_many call in abroadcast_to_users
+FANOUT_BATCH_SIZE = 500
+
 
 def get_channel():
     """Get the channel layer instance."""
     return get_channel_layer()
 
 
+async def group_send_many(groups, message):
+    """
+    Send the same message to several groups.
+
+    On the Redis layer the members of every group are looked up in one
+    pipeline and the message is delivered with one script call per Redis
+    connection, instead of a full group_send round trip per group. Other
+    layers (e.g. InMemoryChannelLayer in development) get one group_send
+    per group.
+
+    Args:
+        groups: Iterable of group names
+        message: Channel layer message (must include 'type')
+    """
+    channel_layer = get_channel()
+    groups = list(dict.fromkeys(groups))
+
+    if RedisChannelLayer is not None and isinstance(channel_layer, RedisChannelLayer):
+        await _redis_group_send_many(channel_layer, groups, message)
+    else:
+        for group in groups:
+            await channel_layer.group_send(group, message)
+
+
+async def _redis_group_send_many(channel_layer, groups, message):
+    # Resolve the channels of all groups, one pipeline per Redis connection
+    groups_by_connection = defaultdict(list)
+    for group in groups:
+        assert channel_layer.valid_group_name(group), "Group name not valid"
+        groups_by_connection[channel_layer.consistent_hash(group)].append(group)
+
+    channel_names = set()
+    group_cutoff = int(time.time()) - channel_layer.group_expiry
+    for index, connection_groups in groups_by_connection.items():
+        pipe = channel_layer.connection(index).pipeline()
+        for group in connection_groups:
+            key = channel_layer._group_key(group)
+            pipe.zremrangebyscore(key, min=0, max=group_cutoff)
+            pipe.zrange(key, 0, -1)
+        results = await pipe.execute()
+        for members in results[1::2]:
+            channel_names.update(name.decode("utf8") for name in members)
+
+    if not channel_names:
+        return
+
+    (
+        connection_to_channel_keys,
+        channel_keys_to_message,
+        channel_keys_to_capacity,
+    ) = channel_layer._map_channel_keys_to_connection(sorted(channel_names), message)
+
+    # Deliver to every channel, again one pipeline per Redis connection
+    over_capacity = 0
+    message_cutoff = int(time.time()) - int(channel_layer.expiry)
+    for index, channel_keys in connection_to_channel_keys.items():
+        args = [channel_keys_to_message[key] for key in channel_keys]
+        args += [channel_keys_to_capacity[key] for key in channel_keys]
+        args += [time.time(), channel_layer.expiry]
+
+        pipe = channel_layer.connection(index).pipeline()
+        for key in channel_keys:
+            pipe.zremrangebyscore(key, min=0, max=message_cutoff)
+        pipe.eval(GROUP_SEND_LUA, len(channel_keys), *channel_keys, *args)
+        over_capacity += (await pipe.execute())[-1]
+
+    if over_capacity:
+        logger.info(
+            "%s of %s channels over capacity in %s groups",
+            over_capacity, len(channel_names), len(groups),
+        )
+
+
 def broadcast_to_room(room_name, event_type, data):
     """
     Broadcast an event to all users in a chat room.
@@ -54,6 +163,39 @@ def broadcast_to_user(user_id, event, data):
     )
 
 
+async def abroadcast_to_users(user_ids, event, data):
+    """
+    Broadcast one notification to many users' notification groups at once.
+
+    Groups are sent FANOUT_BATCH_SIZE at a time, so a user in several
+    large rooms doesn't build one huge pipeline and delivery script.
+
+    Args:
+        user_ids: Iterable of user IDs
+        event: Event name (e.g., 'new_message', 'status_change', 'group_deleted')
+        data: Dictionary of event data (will be merged with event key)
+    """
+    groups = [f"notification_{user_id}" for user_id in user_ids]
+    message = {
+        "type": "notify",
+        "data": {**data, "event": event}
+    }
+    for start in range(0, len(groups), FANOUT_BATCH_SIZE):
+        await group_send_many(groups[start:start + FANOUT_BATCH_SIZE], message)
+
+
+def broadcast_to_users(user_ids, event, data):
+    """
+    Synchronous version of abroadcast_to_users for use in views.
+
+    Args:
+        user_ids: Iterable of user IDs
+        event: Event name
+        data: Dictionary of event data (will be merged with event key)
+    """
+    async_to_sync(abroadcast_to_users)(list(user_ids), event, data)
+
+
 def broadcast_to_room_users(room, event, data):
     """
     Broadcast a notification to all users in a room via their notification groups.
@@ -63,8 +205,7 @@ def broadcast_to_room_users(room, event, data):
         event: Event name
         data: Dictionary of event data (will be merged with event key)
     """
-    for user in room.users.all():
-        broadcast_to_user(user.id, event, data.copy())
+    broadcast_to_users(room.users.values_list('id', flat=True), event, data)
 
 
 def broadcast_message_update(room, event, content, sender, is_delete, is_group=None):
@@ -0,0 +1,175 @@
+"""
+Registry of live WebSocket connections.
+
+Each connection is stored under a key (e.g. a room name) together with its
+user id and an expiry time. Consumers refresh their entry with heartbeats,
+so connections owned by a crashed worker drop out on their own once the
+TTL passes. With REDIS_URL set the registry lives in the same Redis as
+the channel layer and is shared by all workers; otherwise it is kept in
+process memory for development.
+"""
+
+import asyncio
+import time
+import weakref
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+
+class ConnectionRegistry:
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.heartbeat_interval = ttl / 3
+
+    async def add(self, key, user_id, channel_name):
+        """
+        Register a connection.
+
+        Returns:
+            Counter of live connections per user id under the key
+        """
+        return await self._update(key, add=self._member(user_id, channel_name))
+
+    async def remove(self, key, user_id, channel_name):
+        """
+        Unregister a connection.
+
+        Returns:
+            Counter of live connections per user id under the key
+        """
+        return await self._update(key, remove=self._member(user_id, channel_name))
+
+    async def touch(self, key, user_id, channel_name):
+        """Refresh a connection's expiry (heartbeat)."""
+        return await self.add(key, user_id, channel_name)
+
+    async def members(self, key):
+        """Counter of live connections per user id under the key."""
+        return await self._update(key)
+
+    async def members_many(self, keys):
+        """members() for several keys; dict of key -> Counter."""
+        return {key: await self.members(key) for key in keys}
+
+    async def claim(self, name, ttl):
+        """
+        Claim a named job for `ttl` seconds across every process sharing
+        the registry.
+
+        Returns:
+            True if this caller got it
+        """
+        raise NotImplementedError
+
+    async def keep_alive(self, key, user_id, channel_name):
+        """Send heartbeats for a connection until the task is cancelled."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.touch(key, user_id, channel_name)
+
+    @staticmethod
+    def _member(user_id, channel_name):
+        return f"{user_id}|{channel_name}"
+
+    @staticmethod
+    def _count(members):
+        return Counter(int(member.split("|", 1)[0]) for member in members)
+
+    async def _update(self, key, add=None, remove=None):
+        raise NotImplementedError
+
+
+class MemoryConnectionRegistry(ConnectionRegistry):
+    def __init__(self, namespace, ttl):
+        super().__init__(namespace, ttl)
+        self._connections = defaultdict(dict)
+
+    async def _update(self, key, add=None, remove=None):
+        now = time.time()
+        connections = self._connections[key]
+
+        for member, expires_at in list(connections.items()):
+            if expires_at <= now:
+                del connections[member]
+
+        if add:
+            connections[add] = now + self.ttl
+        if remove:
+            connections.pop(remove, None)
+
+        members = list(connections)
+        if not connections:
+            del self._connections[key]
+
+        return self._count(members)
+
+    async def claim(self, name, ttl):
+        # Nothing else shares this registry
+        return True
+
+
+class RedisConnectionRegistry(ConnectionRegistry):
+    def __init__(self, namespace, ttl, url):
+        super().__init__(namespace, ttl)
+        self.url = url
+        # redis.asyncio clients are bound to the loop they were created on
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.asyncio.Redis.from_url(self.url)
+        return client
+
+    async def _update(self, key, add=None, remove=None):
+        now = time.time()
+        redis_key = f"connections:{self.namespace}:{key}"
+
+        # One round trip: drop expired entries, apply the change, read back
+        pipe = self._client().pipeline()
+        pipe.zremrangebyscore(redis_key, "-inf", now)
+        if add:
+            pipe.zadd(redis_key, {add: now + self.ttl})
+        if remove:
+            pipe.zrem(redis_key, remove)
+        pipe.zrange(redis_key, 0, -1)
+        pipe.expire(redis_key, int(self.ttl))
+        results = await pipe.execute()
+
+        return self._count(member.decode("utf8") for member in results[-2])
+
+    async def members_many(self, keys):
+        # One round trip; a read-only range skips expired entries
+        now = time.time()
+        pipe = self._client().pipeline()
+        for key in keys:
+            pipe.zrangebyscore(f"connections:{self.namespace}:{key}", now, "+inf")
+        results = await pipe.execute()
+
+        return {
+            key: self._count(member.decode("utf8") for member in members)
+            for key, members in zip(keys, results)
+        }
+
+    async def claim(self, name, ttl):
+        return bool(await self._client().set(
+            f"connections:{self.namespace}:claim:{name}", 1, nx=True, ex=max(int(ttl), 1)))
+
+
+def get_connection_registry(namespace):
+    """Registry backed by Redis when REDIS_URL is set, memory otherwise."""
+    ttl = settings.CHAT_CONNECTION_TTL
+    if settings.REDIS_URL:
+        return RedisConnectionRegistry(namespace, ttl, settings.REDIS_URL)
+    return MemoryConnectionRegistry(namespace, ttl)
+
+
+# Who is currently viewing each room, keyed by room name
+viewer_registry = get_connection_registry("viewers")
+# Live notification sockets of each user, keyed by user id
+presence_registry = get_connection_registry("presence")
@@ -1,64 +1,114 @@
-import json
+import uuid
 
 import asyncio
-from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.utils import timezone
-from .models import ChatRoom, Message, MessageReadStatus
-from .utils import serialize_user
+from django.conf import settings
+from django.db import IntegrityError
+from notifications.last_seen import last_seen_buffer
+from .activity import TypingTracker, presence_debouncer
+from .broadcast_utils import abroadcast_to_users
+from .connections import viewer_registry
+from .frames import FrameCodecMixin
+from .models import ChatRoom, Message
+from .utils import amark_room_read, create_message, get_viewer_list, serialize_chat_message
 from channels.exceptions import DenyConnection
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def parse_client_id(value):
+    """Return the client-generated message id as a UUID, or None if invalid."""
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+class ChatConsumer(FrameCodecMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"chat_{self.room_name}"
         self.user = self.scope["user"]
+        self.room = None
+        self.heartbeat = None
+
+        # Resolve the room and its members once; every later event on this
+        # connection works from this cached state.
+        try:
+            room = await ChatRoom.objects.aget(name=self.room_name)
+        except ChatRoom.DoesNotExist:
+            raise DenyConnection("Room does not exist.")
+
+        member_ids = {
+            user_id async for user_id in room.users.values_list("id", flat=True)
+        }
+        if self.user.id not in member_ids:
+            raise DenyConnection("Not allowed.")
+
+        self.room = room
+        self.member_ids = member_ids
+        self.typing = TypingTracker(
+            self.broadcast_typing,
+            throttle=settings.CHAT_TYPING_THROTTLE,
+            timeout=settings.CHAT_TYPING_TIMEOUT,
+        )
 
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        room = await sync_to_async(ChatRoom.objects.get)(name=self.room_name)
 
-        if self.user not in await database_sync_to_async(lambda: list(room.users.all()))():
-            raise DenyConnection("Not allowed.")
+        await amark_room_read(self.user, room)
 
-        await mark_messages_as_read(self.user, room)
+        await self.accept_frames()
 
-        await self.accept()
+        viewers = await viewer_registry.add(
+            self.room_name, self.user.id, self.channel_name)
+        self.heartbeat = asyncio.create_task(viewer_registry.keep_alive(
+            self.room_name, self.user.id, self.channel_name))
+        last_seen_buffer.touch(self.user.id)
+        last_seen_buffer.start()
 
-        # Broadcast user_join event
-        # Small delay to ensure connection is stable and allow disconnect events from
-        # previous sessions (e.g. refresh) to propagate first for debounce logic.
-        await asyncio.sleep(0.5)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "chat_activity",
-                "data": {
-                    "event": "user_join",
-                    "username": self.user.username
-                }
-            }
-        )
+        # Late joiners get the current viewers instead of waiting for joins
+        await self.send_frame({
+            "event": "viewers",
+            "viewers": await get_viewer_list(viewers),
+        })
+
+        # A reconnect within the grace period (e.g. a page refresh) cancels
+        # the pending leave, so the room never saw the user go
+        if presence_debouncer.cancel_leave(self.room_name, self.user.id):
+            return
 
+        # Other tabs of this user are already in the room
+        if viewers[self.user.id] > 1:
+            return
 
+        # Broadcast user_join event
+        await self.broadcast_activity("user_join")
 
     async def disconnect(self, close_code):
-        # Broadcast user_leave event
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "chat_activity",
-                "data": {
-                    "event": "user_leave",
-                    "username": self.user.username
-                }
-            }
-        )
+        # Connection was denied before joining the room group
+        if self.room is None:
+            return
+
+        # Make sure nobody is left looking at a typing indicator
+        await self.typing.stop()
+
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        last_seen_buffer.touch(self.user.id)
+        viewers = await viewer_registry.remove(
+            self.room_name, self.user.id, self.channel_name)
+
+        # Broadcast user_leave event once the user's last connection is gone,
+        # unless they come straight back
+        if not viewers[self.user.id]:
+            presence_debouncer.schedule_leave(
+                self.room_name,
+                self.user.id,
+                lambda: self.broadcast_activity("user_leave")
+            )
 
         # Leave room group
         await self.channel_layer.group_discard(
@@ -67,71 +117,73 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
+        last_seen_buffer.touch(self.user.id)
         match text_data_json["type"]:
             case "message":
 
                 message = text_data_json["data"]["message"]
                 is_file = text_data_json["data"].get("is_file", False)
+                client_id = parse_client_id(text_data_json["data"].get("client_id"))
                 user = self.user
-                room = await sync_to_async(ChatRoom.objects.get)(name=self.room_name)
-
-                # Save the message
-                msg = await sync_to_async(Message.objects.create)(
-                    user=user,
-                    room=room,
-                    content=message,
-                    is_file=is_file
-                )
+
+                # Sending a message ends typing
+                await self.typing.stop()
+
+                # Save the message; a retry of an already stored send only
+                # gets its ack again
+                try:
+                    msg = await database_sync_to_async(create_message)(
+                        user=user,
+                        room=self.room,
+                        content=message,
+                        is_file=is_file,
+                        client_id=client_id
+                    )
+                except IntegrityError:
+                    # Only unique_message_client_id marks a retry; the stored
+                    # send must exist, anything else is a real failure
+                    if client_id is None:
+                        raise
+                    msg = await Message.objects.select_related("user").filter(
+                        user=user, client_id=client_id).afirst()
+                    if msg is None:
+                        raise
+                    await self.send_ack(msg)
+                    return
+
+                # Confirm the send to this socket before fanning out
+                await self.send_ack(msg)
 
                 # Send message to room group
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         "type": "chat.message",
-                        "data": {
-                            "id": msg.id,
-                            "message": msg.content,
-                            "sender": serialize_user(msg.user),
-                            "timestamp": msg.timestamp.isoformat(),
-                            "is_file": msg.is_file
-                        }
+                        "data": serialize_chat_message(msg)
                     }
                 )
 
-                room_users = await sync_to_async(lambda: list(room.users.all()))()
-                for u in room_users:
-                    # is_read = (u == user)
-                    # TODO: Maybe this should be false by default?
-                    is_read = False
-                    await sync_to_async(MessageReadStatus.objects.create)(
-                        user=u, message=msg, is_read=is_read
-                    )
-
-                    # Send notification to each user (including sender for sidebar update)
-                    await self.channel_layer.group_send(
-                        f"notification_{u.id}",
-                        {
-                            "type": "notify",
-                            "data": {
-                                "event": "new_message",
-                                "from": msg.user.username,
-                                "from_user_id": msg.user.id,
-                                "from_full_name": msg.user.full_name or msg.user.username,
-                                "room_id": str(msg.room.room_id),
-                                "room_name": msg.room.name,
-                                "content": msg.content,
-                                "is_file": msg.is_file,
-                                "is_image": msg.is_image
-                            }
-                        }
-                    )
+                # Send notification to each user (including sender for sidebar update)
+                await abroadcast_to_users(
+                    self.member_ids,
+                    "new_message",
+                    {
+                        "from": msg.user.username,
+                        "from_user_id": msg.user.id,
+                        "from_full_name": msg.user.full_name or msg.user.username,
+                        "room_id": str(msg.room.room_id),
+                        "room_name": msg.room.name,
+                        "content": msg.content,
+                        "is_file": msg.is_file,
+                        "is_image": msg.is_image
+                    }
+                )
 
             case "message_read":
-                room = await sync_to_async(ChatRoom.objects.get)(name=self.room_name)
                 # all users currently in the room will send this "receipt" acknowledging that they've "read" the message
-                await mark_messages_as_read(self.user, room)
+                await amark_room_read(self.user, self.room)
 
                 await self.channel_layer.group_send(
                     f"notification_{self.user.id}",
@@ -139,68 +191,89 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         "type": "notify",
                         "data": {
                             "event": "unread_cleared",
-                            "room_id": str(room.room_id),
+                            "room_id": str(self.room.room_id),
                         }
                     }
                 )
 
             case "typing":
-                # Broadcast typing status to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat.activity",
-                        "data": {
-                            "event": "typing",
-                            "username": self.user.username,
-                            "is_typing": text_data_json["data"]["is_typing"]
-                        }
-                    }
-                )
+                # Only typing state changes reach the room group
+                await self.typing.update(bool(text_data_json["data"]["is_typing"]))
 
             case _:
                 print("Unknown type")
 
+    async def send_ack(self, msg):
+        await self.send_frame({
+            "event": "message_ack",
+            **serialize_chat_message(msg),
+        })
+
+    async def broadcast_activity(self, event):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                "type": "chat_activity",
+                "data": {
+                    "event": event,
+                    "username": self.user.username
+                }
+            }
+        )
+
+    async def broadcast_typing(self, is_typing):
+        # Broadcast typing status to room group
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                "type": "chat.activity",
+                "data": {
+                    "event": "typing",
+                    "username": self.user.username,
+                    "is_typing": is_typing
+                }
+            }
+        )
+
     # Receive message from room group
 
     async def chat_message(self, event):
 
         # Send message to WebSocket
-        await self.send(
-            text_data=json.dumps(event["data"])
-        )
+        await self.send_frame(event["data"])
 
     async def chat_activity(self, event):
-        await self.send(
-            text_data=json.dumps(event["data"])
-        )
+        await self.send_frame(event["data"])
 
     async def group_update(self, event):
         """Handle group management updates"""
-        await self.send(text_data=json.dumps(event['data']))
+        data = event['data']
+
+        # Keep the cached member set in sync with membership changes
+        match data.get('event_type'):
+            case 'member_left' | 'member_kicked':
+                self.member_ids.discard(data['user_id'])
+            case 'member_added':
+                self.member_ids.add(data['user_id'])
+
+        await self.send_frame(data)
+
+        # This connection's user is no longer a member
+        if self.user.id not in self.member_ids:
+            await self.close()
 
     async def chat_message_edited(self, event):
         """Handle message edit events"""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'event': 'message_edited',
             'message_id': event['data']['message_id'],
             'content': event['data']['content'],
             'sender_id': event['data']['sender_id']
-        }))
+        })
 
     async def chat_message_deleted(self, event):
         """Handle message delete events"""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'event': 'message_deleted',
             'message_id': event['data']['message_id']
-        }))
-
-
-@database_sync_to_async
-def mark_messages_as_read(user, room):
-    MessageReadStatus.objects.filter(
-        user=user, message__room=room, is_read=False
-    ).update(is_read=True, read_at=timezone.now())
-
-
-
+        })
@@ -1,14 +1,9 @@
-from .models import Message, MessageReadStatus
-from friends.models import FriendRequest
+from .sidebar import SidebarContext
 
 
 def unread_count(request):
     if request.user.is_authenticated:
-        total_unread = MessageReadStatus.objects.filter(
-            user=request.user,
-            is_read=False
-        ).count()
-        return {'unread_count': total_unread}
+        return {'unread_count': SidebarContext.for_request(request).unread_count}
     return {'unread_count': 0}
 
 
@@ -17,14 +12,24 @@ def friend_requests_count(request):
     Context processor to add pending friend request count to all templates
     """
     if request.user.is_authenticated:
-        pending_requests_count = FriendRequest.objects.filter(
-            to_user=request.user,
-            is_accepted=False
-        ).count()
-        return {'pending_requests_count': pending_requests_count}
+        return {
+            'pending_requests_count': SidebarContext.for_request(request).pending_requests_count
+        }
     return {'pending_requests_count': 0}
 
 
+def sidebar(request):
+    """Chat sidebar rooms and the friends list used by the create group modal"""
+    if request.user.is_authenticated:
+        sidebar_context = SidebarContext.for_request(request)
+        return {
+            'rooms': sidebar_context.rooms,
+            'has_more_rooms': sidebar_context.has_more_rooms,
+            'friends': sidebar_context.friends,
+        }
+    return {}
+
+
 def version(request):
     return {'version': '1.2'}
 
@@ -0,0 +1,90 @@
+"""
+WebSocket frame encoding.
+
+JSON text frames are the default. Clients that offer the
+``guffgaff.msgpack`` subprotocol get binary msgpack frames instead, with
+the common field names shortened (see SHORT_KEYS).
+"""
+import json
+
+import msgpack
+
+MSGPACK_PROTOCOL = "guffgaff.msgpack"
+
+# Field name -> key used on msgpack frames. Names that are not listed are
+# sent as they are. chat/static/chat/wire.js keeps the same table.
+SHORT_KEYS = {
+    "type": "t",
+    "data": "d",
+    "event": "e",
+    "id": "i",
+    "client_id": "c",
+    "message": "m",
+    "message_id": "mi",
+    "content": "ct",
+    "sender": "s",
+    "sender_id": "si",
+    "timestamp": "ts",
+    "is_file": "f",
+    "is_image": "im",
+    "is_typing": "ty",
+    "username": "u",
+    "full_name": "n",
+    "user_id": "ui",
+    "is_online": "o",
+    "room_id": "r",
+    "room_name": "rn",
+    "from": "fr",
+    "from_user_id": "fi",
+    "from_full_name": "fn",
+    "viewers": "v",
+    "connections": "cn",
+    "statuses": "st",
+    "user_ids": "us",
+}
+LONG_KEYS = {short: name for name, short in SHORT_KEYS.items()}
+
+
+def _rename_keys(value, keys):
+    if isinstance(value, dict):
+        return {keys.get(k, k): _rename_keys(v, keys) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rename_keys(v, keys) for v in value]
+    return value
+
+
+def encode_msgpack(data):
+    return msgpack.packb(_rename_keys(data, SHORT_KEYS))
+
+
+def decode_msgpack(payload):
+    return _rename_keys(msgpack.unpackb(payload), LONG_KEYS)
+
+
+class FrameCodecMixin:
+    """
+    Frame format negotiation for AsyncWebsocketConsumer subclasses.
+
+    Consumers call accept_frames() instead of accept(), send_frame(data)
+    instead of send(text_data=json.dumps(data)) and decode_frame() on what
+    receive() gets.
+    """
+    use_msgpack = False
+
+    async def accept_frames(self):
+        if MSGPACK_PROTOCOL in self.scope.get("subprotocols", []):
+            self.use_msgpack = True
+            await self.accept(MSGPACK_PROTOCOL)
+        else:
+            await self.accept()
+
+    async def send_frame(self, data):
+        if self.use_msgpack:
+            await self.send(bytes_data=encode_msgpack(data))
+        else:
+            await self.send(text_data=json.dumps(data))
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return decode_msgpack(bytes_data)
+        return json.loads(text_data)
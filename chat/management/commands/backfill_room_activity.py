@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from chat.models import ChatRoom, Message
+
+
+class Command(BaseCommand):
+    help = "Fill in ChatRoom.last_message and last_activity_at from the message history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Rooms updated per UPDATE statement (default: 1000).")
+
+    def handle(self, *args, batch_size, **options):
+        latest = Message.objects.filter(room=OuterRef("pk")).order_by("-timestamp", "-id")
+        room_ids = list(ChatRoom.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            ChatRoom.objects.filter(pk__in=batch).update(
+                last_message=Subquery(latest.values("id")[:1]),
+                last_activity_at=Coalesce(
+                    Subquery(latest.values("timestamp")[:1]), F("created_at")),
+            )
+            self.stdout.write(f"Updated {start + len(batch)}/{len(room_ids)} rooms")
+
+        self.stdout.write(self.style.SUCCESS("Room activity backfilled."))
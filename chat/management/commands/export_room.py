@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import CONTENT_TYPES, export_lines, export_messages, export_row, parse_export_bound
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Stream a room's full message history as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("room_name", help="ChatRoom.name of the room to export.")
+        parser.add_argument(
+            "--format", choices=sorted(CONTENT_TYPES), default="ndjson",
+            help="Output format (default: ndjson).")
+        parser.add_argument(
+            "--start", help="Only messages at or after this ISO date or datetime.")
+        parser.add_argument(
+            "--end", help="Only messages before this ISO date or datetime.")
+        parser.add_argument(
+            "--output", help="File to write to (default: stdout).")
+        parser.add_argument(
+            "--base-url", default="",
+            help="Prefix for attachment URLs, e.g. https://chat.example.com.")
+
+    def handle(self, *args, room_name, format, start, end, output, base_url, **options):
+        try:
+            room = ChatRoom.objects.get(name=room_name)
+        except ChatRoom.DoesNotExist:
+            raise CommandError(f"Room {room_name!r} does not exist.")
+        try:
+            start = parse_export_bound(start) if start else None
+            end = parse_export_bound(end) if end else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        absolute_url = (lambda url: base_url.rstrip("/") + url) if base_url else None
+        rows = (export_row(msg, absolute_url) for msg in export_messages(room, start, end))
+
+        lines = export_lines(rows, format)
+
+        if output:
+            with open(output, "w", newline="") as out:
+                out.writelines(lines)
+            self.stderr.write(self.style.SUCCESS(f"Exported {room_name} to {output}."))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def build_conversations(apps, schema_editor):
+    """
+    Create a Conversation row for every room membership.
+
+    Unread counts are carried over from the per-message MessageReadStatus
+    rows, which are dropped in the next migration.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    MessageReadStatus = apps.get_model('chat', 'MessageReadStatus')
+    Membership = ChatRoom.users.through
+
+    latest = Message.objects.filter(room=OuterRef('chatroom_id')).order_by('-timestamp', '-id')
+    unread = (
+        MessageReadStatus.objects.filter(
+            user=OuterRef('customuser_id'),
+            message__room=OuterRef('chatroom_id'),
+            is_read=False,
+        )
+        .exclude(message__user=OuterRef('customuser_id'))
+        .order_by().values('user').annotate(count=Count('id')).values('count')
+    )
+
+    memberships = Membership.objects.annotate(
+        last_activity_at=Coalesce(
+            Subquery(latest.values('timestamp')[:1]), F('chatroom__created_at')),
+        unread_count=Coalesce(Subquery(unread), 0),
+    ).values_list(
+        'customuser_id', 'chatroom_id', 'last_activity_at', 'unread_count')
+
+    Conversation.objects.bulk_create(
+        (
+            Conversation(
+                user_id=user_id,
+                room_id=room_id,
+                last_activity_at=last_activity_at,
+                unread_count=unread_count,
+            )
+            for user_id, room_id, last_activity_at, unread_count
+            in memberships.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0021_message_client_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity_at', '-id'], name='conversation_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'room'), name='unique_conversation')],
+            },
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+    ]
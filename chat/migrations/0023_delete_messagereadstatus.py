@@ -0,0 +1,16 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_conversation'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MessageReadStatus',
+        ),
+    ]
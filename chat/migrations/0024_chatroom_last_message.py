@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def seed_room_activity(apps, schema_editor):
+    """Point every room at its newest message."""
+    Message = apps.get_model('chat', 'Message')
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+
+    newest = Message.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id')
+    ChatRoom.objects.update(
+        last_message_id=Subquery(newest.values('id')[:1]),
+        last_activity_at=Subquery(newest.values('timestamp')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0023_delete_messagereadstatus'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['-last_activity_at', 'room_id'], name='chatroom_activity_idx'),
+        ),
+        migrations.RunPython(seed_room_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:12
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing messages were last changed when edited, or else when sent."""
+    Message = apps.get_model('chat', 'Message')
+    Message.objects.update(updated_at=Coalesce('edited_at', 'timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0025_message_room_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'updated_at', 'id'], name='message_room_updated_idx'),
+        ),
+    ]
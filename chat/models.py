@@ -13,9 +13,20 @@ class ChatRoom(models.Model):
     users = models.ManyToManyField(CustomUser, related_name="chat_rooms")
     display_name = models.CharField(max_length=255)
 
+    # Newest message and its time, kept up to date by record_message so
+    # previews and activity ordering don't have to scan the room's history
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
     is_delete = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_activity_at', 'room_id'], name='chatroom_activity_idx'),
+        ]
+
     def __str__(self):
         return self.display_name
 
@@ -29,6 +40,10 @@ class Message(models.Model):
     file = models.FileField(upload_to='chat_uploads/', null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     edited_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every save (edit, delete); sync_messages diffs on it
+    updated_at = models.DateTimeField(auto_now=True)
+    # Generated by the sending client so a retried send is stored only once
+    client_id = models.UUIDField(null=True, blank=True)
 
     is_file = models.BooleanField(default=False)
     is_delete = models.BooleanField(default=False)
@@ -38,6 +53,16 @@ class Message(models.Model):
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['timestamp']),
+            # History paging: get_messages orders by (timestamp, id) per room
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_timestamp_idx'),
+            models.Index(fields=['room', 'updated_at', 'id'], name='message_room_updated_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='unique_message_client_id',
+            ),
         ]
 
     def __str__(self):
@@ -51,17 +76,27 @@ class Message(models.Model):
         return ext in ['jpg', 'jpeg', 'png', 'gif', 'webp']
 
 
-class MessageReadStatus(models.Model):
-    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, related_name='read_receipts')
-    message = models.ForeignKey(to=Message, on_delete=models.CASCADE, related_name='read_receipts')
-    is_read = models.BooleanField(default=False)
+class Conversation(models.Model):
+    """
+    A user's sidebar entry for one of their rooms.
 
-    read_at = models.DateTimeField(null=True, blank=True)
+    Kept up to date on the write path (new messages, reads, membership
+    changes) so the sidebar reads a user's most recent rooms straight off
+    the (user, last_activity_at) index instead of sorting every room. The
+    preview comes from room.last_message.
+    """
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, related_name='conversations')
+    room = models.ForeignKey(to=ChatRoom, on_delete=models.CASCADE, related_name='conversations')
+    last_activity_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["user", "message"], name="unique_message_read_status")
+                fields=["user", "room"], name="unique_conversation")
+        ]
+        indexes = [
+            models.Index(fields=["user", "-last_activity_at", "-id"], name="conversation_recent_idx"),
         ]
 
 
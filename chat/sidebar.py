@@ -0,0 +1,138 @@
+"""
+Sidebar and navbar data shared by the chat views and context processors.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from friends.models import FriendRequest
+from .utils import get_unread_total
+
+
+def get_conversations(user, before=None):
+    """
+    The user's conversations, most recently active first.
+
+    `before` is the (last_activity_at, id) of the last conversation the
+    client already has; only older ones are returned.
+    """
+    conversations = user.conversations.select_related(
+        'room__group_chat',
+        'room__private_chat__user_a',
+        'room__private_chat__user_b',
+        'room__last_message__user',
+    ).order_by('-last_activity_at', '-id')
+
+    if before:
+        last_activity_at, conversation_id = before
+        conversations = conversations.filter(
+            Q(last_activity_at__lt=last_activity_at)
+            | Q(last_activity_at=last_activity_at, id__lt=conversation_id)
+        )
+    return conversations
+
+
+def get_room_entries(user, conversations):
+    room_data = []
+    for conversation in conversations:
+        room = conversation.room
+
+        # Logic for dynamic display name
+        display_name = room.display_name
+        is_online = False
+        other_user_id = None
+        avatar_url = None
+        is_group = False
+
+        if hasattr(room, 'group_chat'):
+            display_name = room.group_chat.name
+            is_group = True
+            if room.group_chat.icon:
+                avatar_url = room.group_chat.icon.url
+        elif hasattr(room, 'private_chat'):
+            private_chat = room.private_chat
+            other_user = private_chat.user_a if private_chat.user_b == user else private_chat.user_b
+            display_name = other_user.full_name if other_user.full_name else other_user.username
+            is_online = other_user.is_online
+            other_user_id = other_user.id
+            avatar_url = other_user.avatar.url if other_user.avatar else None
+
+        room_data.append(
+            {
+                'room': room,
+                'conversation': conversation,
+                'display_name': display_name,
+                'is_online': is_online,
+                'other_user_id': other_user_id,
+                'last_message': room.last_message,
+                'unread_count': conversation.unread_count,
+                'last_message_timestamp': conversation.last_activity_at,
+                'avatar_url': avatar_url,
+                'is_group': is_group,
+                'group_chat': getattr(room, 'group_chat', None)
+            }
+        )
+    return room_data
+
+
+def _memoized(method):
+    """Cache a SidebarContext method's result for the rest of the request."""
+    def wrapper(self):
+        if method.__name__ not in self._cache:
+            self._cache[method.__name__] = method(self)
+        return self._cache[method.__name__]
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class SidebarContext:
+    """
+    The expensive sidebar pieces for one request, each computed at most once.
+
+    Views and context processors put the bound methods (not their results)
+    into the template context. Django templates call them on first use, so
+    a piece that no template renders costs no queries.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._cache = {}
+
+    @classmethod
+    def for_request(cls, request):
+        if not hasattr(request, "_sidebar_context"):
+            request._sidebar_context = cls(request.user)
+        return request._sidebar_context
+
+    @_memoized
+    def _first_page(self):
+        # One extra row tells whether there is another page
+        return list(get_conversations(self.user)[:settings.CHAT_SIDEBAR_PAGE_SIZE + 1])
+
+    @_memoized
+    def rooms(self):
+        """First page of sidebar entries; conversation_list serves the rest."""
+        return get_room_entries(self.user, self._first_page()[:settings.CHAT_SIDEBAR_PAGE_SIZE])
+
+    @_memoized
+    def has_more_rooms(self):
+        return len(self._first_page()) > settings.CHAT_SIDEBAR_PAGE_SIZE
+
+    @_memoized
+    def friends(self):
+        accepted_requests = FriendRequest.objects.filter(
+            (Q(from_user=self.user) | Q(to_user=self.user)) & Q(is_accepted=True)
+        ).select_related('from_user', 'to_user')
+        return [
+            req.to_user if req.from_user == self.user else req.from_user
+            for req in accepted_requests
+        ]
+
+    @_memoized
+    def pending_requests_count(self):
+        return FriendRequest.objects.filter(to_user=self.user, is_accepted=False).count()
+
+    @_memoized
+    def unread_count(self):
+        """Total unread messages across all of the user's rooms."""
+        return get_unread_total(self.user)
@@ -66,6 +66,50 @@ function createToastContainer() {
   return container;
 }
 
+function bindRoomItems(root) {
+  root.querySelectorAll(".room-item[data-url]").forEach((item) => {
+    item.addEventListener("click", function () {
+      window.location.href = this.dataset.url;
+    });
+  });
+}
+
+let loadingRooms = false;
+
+function loadMoreRooms(roomList) {
+  const items = roomList.querySelectorAll(".room-item[data-conversation-id]");
+  const lastItem = items[items.length - 1];
+  if (loadingRooms || roomList.dataset.hasMore !== "true" || !lastItem) {
+    return;
+  }
+  loadingRooms = true;
+
+  const params = new URLSearchParams({
+    before: lastItem.dataset.activity,
+    before_id: lastItem.dataset.conversationId,
+  });
+  // Lets the server highlight the open room if it is on a later page
+  const roomNameElement = document.getElementById("room-name");
+  if (roomNameElement) {
+    params.set("room", JSON.parse(roomNameElement.textContent));
+  }
+
+  fetch(`/chat/conversations/?${params}`)
+    .then((response) => response.json())
+    .then((data) => {
+      const page = document.createElement("template");
+      page.innerHTML = data.html;
+      bindRoomItems(page.content);
+      roomList.appendChild(page.content);
+      roomList.dataset.hasMore = data.has_more ? "true" : "false";
+      subscribePresence();
+    })
+    .catch((error) => console.error("Error loading conversations:", error))
+    .finally(() => {
+      loadingRooms = false;
+    });
+}
+
 // Global Notification Socket
 let notificationSocket = null;
 
@@ -76,12 +120,12 @@ function connectNotificationSocket() {
   }
 
   const protocol = window.location.protocol === "https:" ? "wss://" : "ws://";
-  notificationSocket = new WebSocket(
+  notificationSocket = Wire.connect(
     protocol + window.location.host + "/ws/notifications/",
   );
 
   notificationSocket.onmessage = function (e) {
-    const data = JSON.parse(e.data);
+    const data = Wire.decode(e.data);
 
     if (data.event === "new_message") {
       // Update last message
@@ -249,17 +293,11 @@ function connectNotificationSocket() {
           }
         }
       }
-    } else if (data.event === "status_change") {
-      const statusDot = document.getElementById(`status-dot-${data.user_id}`);
-      if (statusDot) {
-        if (data.is_online) {
-          statusDot.classList.remove("offline");
-          statusDot.classList.add("online");
-        } else {
-          statusDot.classList.remove("online");
-          statusDot.classList.add("offline");
-        }
-      }
+    } else if (data.event === "status_batch") {
+      // Presence of the users we subscribed to, collected server side
+      data.statuses.forEach((status) =>
+        setStatusDot(status.user_id, status.is_online),
+      );
     } else if (data.event === "group_created") {
       // Reload page to show new group in sidebar
       // TODO: Implement dynamic sidebar insertion
@@ -271,7 +309,33 @@ function connectNotificationSocket() {
     setTimeout(connectNotificationSocket, 3000);
   };
 
-  notificationSocket.onopen = function (e) {};
+  notificationSocket.onopen = function (e) {
+    subscribePresence();
+  };
+}
+
+// Follow the presence of the users whose status dots are on the page.
+// The server only sends status changes for them.
+function subscribePresence() {
+  if (!notificationSocket || notificationSocket.readyState !== WebSocket.OPEN) {
+    return;
+  }
+  const userIds = Array.from(
+    document.querySelectorAll(".online-dot[id^='status-dot-']"),
+    (dot) => parseInt(dot.id.slice("status-dot-".length), 10),
+  ).filter((userId) => !isNaN(userId));
+  Wire.send(notificationSocket, {
+    type: "presence_subscribe",
+    data: { user_ids: [...new Set(userIds)] },
+  });
+}
+
+function setStatusDot(userId, isOnline) {
+  const statusDot = document.getElementById(`status-dot-${userId}`);
+  if (statusDot) {
+    statusDot.classList.toggle("online", isOnline);
+    statusDot.classList.toggle("offline", !isOnline);
+  }
 }
 
 // Helper function to get CSRF cookie
@@ -435,11 +499,20 @@ document.addEventListener("DOMContentLoaded", function () {
   }
 
   // Handle sidebar room clicks (replaced inline onclick)
-  document.querySelectorAll(".room-item[data-url]").forEach((item) => {
-    item.addEventListener("click", function () {
-      window.location.href = this.dataset.url;
+  bindRoomItems(document);
+
+  // Load older conversations when the sidebar is scrolled to the bottom
+  const roomList = document.querySelector(".room-list[data-has-more]");
+  if (roomList) {
+    roomList.addEventListener("scroll", () => {
+      if (
+        roomList.scrollTop + roomList.clientHeight >=
+        roomList.scrollHeight - 100
+      ) {
+        loadMoreRooms(roomList);
+      }
     });
-  });
+  }
 
   // User menu dropdown
   const userMenu = document.querySelector(".user-menu");
@@ -195,27 +195,23 @@ chatMessageInput.onkeydown = function (e) {
     (e.key.length === 1 || e.key === "Backspace")
   ) {
     if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-      chatSocket.send(
-        JSON.stringify({
-          type: "typing",
-          data: {
-            is_typing: true,
-          },
-        }),
-      );
+      Wire.send(chatSocket, {
+        type: "typing",
+        data: {
+          is_typing: true,
+        },
+      });
     }
 
     clearTimeout(typingTimeout);
     typingTimeout = setTimeout(() => {
       if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-        chatSocket.send(
-          JSON.stringify({
-            type: "typing",
-            data: {
-              is_typing: false,
-            },
-          }),
-        );
+        Wire.send(chatSocket, {
+          type: "typing",
+          data: {
+            is_typing: false,
+          },
+        });
       }
     }, 1000);
   }
@@ -272,14 +268,12 @@ chatMessageSubmit.onclick = function () {
 
   // Stop typing indicator
   if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-    chatSocket.send(
-      JSON.stringify({
-        type: "typing",
-        data: {
-          is_typing: false,
-        },
-      }),
-    );
+    Wire.send(chatSocket, {
+      type: "typing",
+      data: {
+        is_typing: false,
+      },
+    });
   }
 
   if (file) {
@@ -339,17 +333,7 @@ chatMessageSubmit.onclick = function () {
       })
       .then((data) => {
         if (data.file_url) {
-          if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-            chatSocket.send(
-              JSON.stringify({
-                type: "message",
-                data: {
-                  message: data.file_url,
-                  is_file: true,
-                },
-              }),
-            );
-          }
+          sendChatMessage(data.file_url, true);
           fileInput.value = ""; // Clear input
           fileNameDisplay.textContent = ""; // Clear display
         } else if (data.error) {
@@ -374,22 +358,52 @@ chatMessageSubmit.onclick = function () {
   }
 
   if (message) {
-    // Send via WebSocket - message will appear for everyone (including sender) via broadcast
-    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-      chatSocket.send(
-        JSON.stringify({
-          type: "message",
-          data: {
-            message: message,
-            is_file: false,
-          },
-        }),
-      );
-    }
+    sendChatMessage(message, false);
     messageInputDom.value = "";
   }
 };
 
+function generateClientId() {
+  if (window.crypto && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  // crypto.randomUUID is only available on secure origins
+  return "xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx".replace(/[xy]/g, (c) => {
+    const r = (Math.random() * 16) | 0;
+    return (c === "x" ? r : (r & 0x3) | 0x8).toString(16);
+  });
+}
+
+function sendChatMessage(message, isFile) {
+  const clientId = generateClientId();
+  const frame = {
+    type: "message",
+    data: {
+      message: message,
+      is_file: isFile,
+      client_id: clientId,
+    },
+  };
+  pendingMessages.set(clientId, frame);
+
+  // Show text right away; the server's ack replaces it with the stored message
+  if (!isFile) {
+    showMessage({
+      id: null,
+      client_id: clientId,
+      message: message,
+      sender: { id: my_id },
+      timestamp: new Date().toISOString(),
+      is_file: false,
+    }).classList.add("pending");
+  }
+
+  // While disconnected, onopen sends it after the reconnect
+  if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+    Wire.send(chatSocket, frame);
+  }
+}
+
 function getCookie(name) {
   let cookieValue = null;
   if (document.cookie && document.cookie !== "") {
@@ -420,10 +434,18 @@ if (roomIdElement) {
 }
 
 let chatSocket = null;
+// Sent messages the server has not acknowledged yet, keyed by client id.
+// They are sent again after a reconnect; the server drops duplicates.
+const pendingMessages = new Map();
+// Server time the messages on the page are current as of. After a
+// reconnect, syncMessages asks for everything that changed since then.
+let syncCursor = JSON.parse(document.getElementById("sync-cursor").textContent);
+let syncEtag = null;
+let hasConnected = false;
 
 function connectChatSocket() {
   const protocol = window.location.protocol === "https:" ? "wss://" : "ws://";
-  chatSocket = new WebSocket(
+  chatSocket = Wire.connect(
     protocol + window.location.host + "/ws/chat/" + roomName + "/",
   );
 
@@ -433,7 +455,60 @@ function connectChatSocket() {
     setTimeout(connectChatSocket, 3000);
   };
 
-  chatSocket.onopen = function (e) {};
+  chatSocket.onopen = function (e) {
+    pendingMessages.forEach((frame) => Wire.send(chatSocket, frame));
+    if (hasConnected) {
+      syncMessages();
+    }
+    hasConnected = true;
+  };
+}
+
+// Live messages carry server timestamps; keep the cursor just behind them
+function advanceSyncCursor(timestamp) {
+  if (timestamp && new Date(timestamp) > new Date(syncCursor)) {
+    syncCursor = timestamp;
+  }
+}
+
+// Fetch what was sent, edited or deleted while the socket was down
+function syncMessages() {
+  const headers = syncEtag ? { "If-None-Match": syncEtag } : {};
+  fetch(
+    `/chat/messages/${roomName}/sync/?since=${encodeURIComponent(syncCursor)}`,
+    { headers: headers, cache: "no-store" },
+  )
+    .then((response) => {
+      if (response.status === 304) {
+        return null;
+      }
+      if (!response.ok) {
+        throw new Error(`Sync failed with status ${response.status}`);
+      }
+      syncEtag = response.headers.get("ETag");
+      return response.json();
+    })
+    .then((data) => {
+      if (!data) {
+        return;
+      }
+      // Missed too much for a delta; start over from the latest page
+      if (data.has_more) {
+        window.location.reload();
+        return;
+      }
+      data.messages.forEach((message) => {
+        pendingMessages.delete(message.client_id);
+        if (!chatLog.querySelector(`[data-message-id="${message.id}"]`)) {
+          showMessage(message);
+        } else if (message.edited) {
+          applyEdit(message.id, message.message);
+        }
+      });
+      data.deleted.forEach(applyDelete);
+      syncCursor = data.cursor;
+    })
+    .catch((error) => console.error(error));
 }
 
 connectChatSocket();
@@ -452,10 +527,12 @@ const observer = new IntersectionObserver(
   { threshold: 0.5 }, // Trigger when 50% of the item is visible
 );
 
-// Pagination
-let offset = 20; // Initial offset (we load 20 messages by default)
+// Pagination: older history is fetched page by page before the oldest
+// message shown, so pages don't shift when new messages arrive
+const firstMessage = chatLog.querySelector(".message[data-message-id]");
+let oldestMessageId = firstMessage ? firstMessage.dataset.messageId : null;
 let isLoading = false;
-let allMessagesLoaded = false;
+let allMessagesLoaded = oldestMessageId === null;
 
 function fetchMessages() {
   if (isLoading || allMessagesLoaded) return;
@@ -463,11 +540,11 @@ function fetchMessages() {
 
   const currentScrollHeight = chatLog.scrollHeight;
 
-  fetch(`/chat/messages/${roomName}/?offset=${offset}`)
+  fetch(`/chat/messages/${roomName}/?before=${oldestMessageId}`)
     .then((response) => response.json())
     .then((data) => {
+      allMessagesLoaded = !data.has_more;
       if (data.messages.length === 0) {
-        allMessagesLoaded = true;
         isLoading = false;
         return;
       }
@@ -476,6 +553,7 @@ function fetchMessages() {
         // Safe construction of message element
         const msgDiv = document.createElement("div");
         msgDiv.className = `message ${msg.is_me ? "sent" : "received"}`;
+        msgDiv.dataset.messageId = msg.id;
 
         const contentDiv = document.createElement("div");
         contentDiv.className = "message-content";
@@ -582,7 +660,8 @@ function fetchMessages() {
         chatLog.insertAdjacentElement("afterbegin", msgDiv);
       });
 
-      offset += data.messages.length;
+      // Messages come newest first
+      oldestMessageId = data.messages[data.messages.length - 1].id;
 
       // Maintain scroll position
       chatLog.scrollTop = chatLog.scrollHeight - currentScrollHeight;
@@ -615,34 +694,34 @@ chatLog.addEventListener("scroll", () => {
 });
 
 function handleMessageReceive(e) {
-  const data = JSON.parse(e.data);
+  const data = Wire.decode(e.data);
   // console.table(data);
 
-  if (data.event === "user_join" || data.event === "user_leave") {
-    // Initialize pending leaves tracker
-    if (!window.pendingLeaves) {
-      window.pendingLeaves = {};
-    }
+  // Current viewers, sent once when the socket connects; the page has
+  // no viewer list, so the join and leave notices are all it shows
+  if (data.event === "viewers") {
+    return;
+  }
 
+  // The server stored one of our sends; show it as sent right away
+  if (data.event === "message_ack") {
+    pendingMessages.delete(data.client_id);
+    showMessage(data);
+    advanceSyncCursor(data.timestamp);
+    return;
+  }
+
+  if (data.event === "user_join" || data.event === "user_leave") {
+    // The server already holds back leaves for quick reconnects (reload),
+    // so both events can be shown as they arrive
     if (data.event === "user_leave") {
-      // Delay leave message to check for immediate reconnect (reload)
-      window.pendingLeaves[data.username] = setTimeout(() => {
-        showSystemMessage(`${data.username} left the chat`);
-        delete window.pendingLeaves[data.username];
-      }, 2000); // 2 second grace period
+      showSystemMessage(`${data.username} left the chat`);
     } else {
       // user_join
       // Suppress join message for the user themselves
       if (data.username === current_username) {
           return;
       }
-
-      if (window.pendingLeaves[data.username]) {
-        // User reconnected within grace period - cancel leave and suppress join
-        clearTimeout(window.pendingLeaves[data.username]);
-        delete window.pendingLeaves[data.username];
-        return;
-      }
       showSystemMessage(`${data.username} joined the chat`);
     }
     return;
@@ -715,14 +794,7 @@ function handleMessageReceive(e) {
 
   // Handle message edit event
   if (data.event === "message_edited") {
-    const messageDiv = document.querySelector(
-      `[data-message-id="${data.message_id}"]`,
-    );
-    if (messageDiv) {
-      const contentDiv = messageDiv.querySelector(".message-content");
-      contentDiv.dataset.originalContent = data.content;
-      contentDiv.innerHTML = `${data.content} <span class="edited-indicator" title="Edited">(edited)</span>`;
-    }
+    applyEdit(data.message_id, data.content);
     return;
   }
 
@@ -757,25 +829,71 @@ function handleMessageReceive(e) {
 
   // Handle message delete event
   if (data.event === "message_deleted") {
-    const messageDiv = document.querySelector(
-      `[data-message-id="${data.message_id}"]`,
-    );
-    if (messageDiv) {
-      const contentDiv = messageDiv.querySelector(".message-content");
-      contentDiv.innerHTML =
-        '<em style="color: var(--text-muted);">Message deleted</em>';
-
-      // Remove edit/delete buttons if they exist
-      const actions = messageDiv.querySelector(".message-actions");
-      if (actions) {
-        actions.remove();
-      }
+    applyDelete(data.message_id);
+    return;
+  }
+
+  showMessage(data);
+  advanceSyncCursor(data.timestamp);
+}
+
+function applyEdit(messageId, content) {
+  const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+  if (messageDiv) {
+    const contentDiv = messageDiv.querySelector(".message-content");
+    contentDiv.dataset.originalContent = content;
+    contentDiv.innerHTML = `${content} <span class="edited-indicator" title="Edited">(edited)</span>`;
+  }
+}
 
-      messageDiv.dataset.isDeleted = "true";
+function applyDelete(messageId) {
+  const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+  if (messageDiv) {
+    const contentDiv = messageDiv.querySelector(".message-content");
+    contentDiv.innerHTML =
+      '<em style="color: var(--text-muted);">Message deleted</em>';
+
+    // Remove edit/delete buttons if they exist
+    const actions = messageDiv.querySelector(".message-actions");
+    if (actions) {
+      actions.remove();
     }
-    return;
+
+    messageDiv.dataset.isDeleted = "true";
   }
+}
 
+// Render a chat message, replacing the optimistic copy of our own sends
+function showMessage(data) {
+  const msgDiv = renderMessage(data);
+
+  const pendingDiv =
+    data.client_id &&
+    chatLog.querySelector(`[data-client-id="${data.client_id}"]`);
+  if (pendingDiv) {
+    pendingDiv.replaceWith(msgDiv);
+  } else {
+    chatLog.appendChild(msgDiv);
+  }
+
+  // Remove "No messages yet" text if it exists
+  const noMessagesText = document.getElementById("no-messages-text");
+  if (noMessagesText) {
+    noMessagesText.remove();
+  }
+
+  // If we are not viewing old messages (i.e., we are at the bottom), scroll to the new message
+  if (!viewingOldMessages) {
+    chatLog.scrollTop = chatLog.scrollHeight;
+    markRead();
+  } else {
+    // If we are viewing old messages, maybe show a "New Message" badge?
+    // For now, just let it append. It won't be marked read until user scrolls down.
+  }
+  return msgDiv;
+}
+
+function renderMessage(data) {
   const isMe = data.sender.id === my_id;
 
   const msgClass = isMe ? "sent" : "received";
@@ -785,6 +903,9 @@ function handleMessageReceive(e) {
   msgDiv.dataset.time = new Date().toISOString();
   msgDiv.dataset.messageId = data.id;
   msgDiv.dataset.isDeleted = "false";
+  if (data.client_id) {
+    msgDiv.dataset.clientId = data.client_id;
+  }
 
   // Add sender name for group chats if it's not me
   if (typeof is_group !== "undefined" && is_group && !isMe) {
@@ -889,8 +1010,8 @@ function handleMessageReceive(e) {
 
   msgDiv.appendChild(contentDiv);
 
-  // Add edit/delete buttons for own non-file messages
-  if (isMe && !data.is_file) {
+  // Add edit/delete buttons for own non-file messages once they are stored
+  if (isMe && !data.is_file && data.id) {
     const actionsDiv = document.createElement("div");
     actionsDiv.className = "message-actions";
 
@@ -948,22 +1069,7 @@ function handleMessageReceive(e) {
   timeDiv.textContent = localTime;
   msgDiv.appendChild(timeDiv);
 
-  chatLog.appendChild(msgDiv);
-
-  // Remove "No messages yet" text if it exists
-  const noMessagesText = document.getElementById("no-messages-text");
-  if (noMessagesText) {
-    noMessagesText.remove();
-  }
-
-  // If we are not viewing old messages (i.e., we are at the bottom), scroll to the new message
-  if (!viewingOldMessages) {
-    chatLog.scrollTop = chatLog.scrollHeight;
-    markRead();
-  } else {
-    // If we are viewing old messages, maybe show a "New Message" badge?
-    // For now, just let it append. It won't be marked read until user scrolls down.
-  }
+  return msgDiv;
 }
 
 function markRead() {
@@ -974,12 +1080,10 @@ function markRead() {
 
   markReadTimeout = setTimeout(() => {
     if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-      chatSocket.send(
-        JSON.stringify({
-          type: "message_read",
-          data: {},
-        }),
-      );
+      Wire.send(chatSocket, {
+        type: "message_read",
+        data: {},
+      });
     }
     markReadTimeout = null;
   }, 100); // 100ms debounce
@@ -0,0 +1,222 @@
+// WebSocket frame encoding shared by index.js and room.js.
+// Sockets offer the msgpack subprotocol. When the server accepts it, frames
+// are binary msgpack with short keys (see chat/frames.py); otherwise JSON.
+const Wire = (function () {
+  const PROTOCOL = "guffgaff.msgpack";
+
+  // Must match SHORT_KEYS in chat/frames.py
+  const SHORT_KEYS = {
+    type: "t",
+    data: "d",
+    event: "e",
+    id: "i",
+    client_id: "c",
+    message: "m",
+    message_id: "mi",
+    content: "ct",
+    sender: "s",
+    sender_id: "si",
+    timestamp: "ts",
+    is_file: "f",
+    is_image: "im",
+    is_typing: "ty",
+    username: "u",
+    full_name: "n",
+    user_id: "ui",
+    is_online: "o",
+    room_id: "r",
+    room_name: "rn",
+    from: "fr",
+    from_user_id: "fi",
+    from_full_name: "fn",
+    viewers: "v",
+    connections: "cn",
+    statuses: "st",
+    user_ids: "us",
+  };
+  const LONG_KEYS = {};
+  for (const key in SHORT_KEYS) {
+    LONG_KEYS[SHORT_KEYS[key]] = key;
+  }
+
+  function renameKeys(value, keys) {
+    if (Array.isArray(value)) {
+      return value.map((item) => renameKeys(item, keys));
+    }
+    if (value !== null && typeof value === "object") {
+      const renamed = {};
+      for (const key in value) {
+        renamed[keys[key] || key] = renameKeys(value[key], keys);
+      }
+      return renamed;
+    }
+    return value;
+  }
+
+  // Minimal msgpack covering what our frames carry: nil, booleans, numbers,
+  // strings, arrays and maps.
+  const textEncoder = new TextEncoder();
+  const textDecoder = new TextDecoder();
+
+  function pack(value) {
+    const bytes = [];
+
+    function pushUint(n, size) {
+      for (let shift = (size - 1) * 8; shift >= 0; shift -= 8) {
+        bytes.push(Math.floor(n / 2 ** shift) & 0xff);
+      }
+    }
+
+    function pushHeader(length, fix, fixLimit, type8, type16, type32) {
+      if (length < fixLimit) {
+        bytes.push(fix | length);
+      } else if (type8 !== null && length < 0x100) {
+        bytes.push(type8, length);
+      } else if (length < 0x10000) {
+        bytes.push(type16);
+        pushUint(length, 2);
+      } else {
+        bytes.push(type32);
+        pushUint(length, 4);
+      }
+    }
+
+    function write(v) {
+      if (v === null || v === undefined) {
+        bytes.push(0xc0);
+      } else if (typeof v === "boolean") {
+        bytes.push(v ? 0xc3 : 0xc2);
+      } else if (typeof v === "number") {
+        if (Number.isInteger(v) && v >= 0 && v <= 0xffffffff) {
+          if (v < 0x80) {
+            bytes.push(v);
+          } else {
+            bytes.push(0xce);
+            pushUint(v, 4);
+          }
+        } else if (Number.isInteger(v) && v >= -0x80000000 && v < 0) {
+          if (v >= -32) {
+            bytes.push(v & 0xff);
+          } else {
+            bytes.push(0xd2);
+            pushUint(v >>> 0, 4);
+          }
+        } else {
+          const view = new DataView(new ArrayBuffer(8));
+          view.setFloat64(0, v);
+          bytes.push(0xcb, ...new Uint8Array(view.buffer));
+        }
+      } else if (typeof v === "string") {
+        const utf8 = textEncoder.encode(v);
+        pushHeader(utf8.length, 0xa0, 32, 0xd9, 0xda, 0xdb);
+        for (const b of utf8) {
+          bytes.push(b);
+        }
+      } else if (Array.isArray(v)) {
+        pushHeader(v.length, 0x90, 16, null, 0xdc, 0xdd);
+        v.forEach(write);
+      } else {
+        const keys = Object.keys(v).filter((key) => v[key] !== undefined);
+        pushHeader(keys.length, 0x80, 16, null, 0xde, 0xdf);
+        keys.forEach((key) => {
+          write(key);
+          write(v[key]);
+        });
+      }
+    }
+
+    write(value);
+    return new Uint8Array(bytes);
+  }
+
+  function unpack(buffer) {
+    const view = new DataView(buffer);
+    let offset = 0;
+
+    function str(length) {
+      const s = textDecoder.decode(new Uint8Array(buffer, offset, length));
+      offset += length;
+      return s;
+    }
+
+    function array(length) {
+      const items = [];
+      for (let i = 0; i < length; i++) {
+        items.push(read());
+      }
+      return items;
+    }
+
+    function map(length) {
+      const obj = {};
+      for (let i = 0; i < length; i++) {
+        const key = read();
+        obj[key] = read();
+      }
+      return obj;
+    }
+
+    function next(size, getter) {
+      const value = view[getter](offset);
+      offset += size;
+      return value;
+    }
+
+    function read() {
+      const type = next(1, "getUint8");
+      if (type < 0x80) return type;
+      if (type < 0x90) return map(type & 0x0f);
+      if (type < 0xa0) return array(type & 0x0f);
+      if (type < 0xc0) return str(type & 0x1f);
+      if (type >= 0xe0) return type - 0x100;
+      switch (type) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xca: return next(4, "getFloat32");
+        case 0xcb: return next(8, "getFloat64");
+        case 0xcc: return next(1, "getUint8");
+        case 0xcd: return next(2, "getUint16");
+        case 0xce: return next(4, "getUint32");
+        case 0xcf: return Number(next(8, "getBigUint64"));
+        case 0xd0: return next(1, "getInt8");
+        case 0xd1: return next(2, "getInt16");
+        case 0xd2: return next(4, "getInt32");
+        case 0xd3: return Number(next(8, "getBigInt64"));
+        case 0xd9: return str(next(1, "getUint8"));
+        case 0xda: return str(next(2, "getUint16"));
+        case 0xdb: return str(next(4, "getUint32"));
+        case 0xdc: return array(next(2, "getUint16"));
+        case 0xdd: return array(next(4, "getUint32"));
+        case 0xde: return map(next(2, "getUint16"));
+        case 0xdf: return map(next(4, "getUint32"));
+      }
+      throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+    }
+
+    return read();
+  }
+
+  return {
+    connect(url) {
+      const socket = new WebSocket(url, [PROTOCOL]);
+      socket.binaryType = "arraybuffer";
+      return socket;
+    },
+
+    send(socket, data) {
+      if (socket.protocol === PROTOCOL) {
+        socket.send(pack(renameKeys(data, SHORT_KEYS)));
+      } else {
+        socket.send(JSON.stringify(data));
+      }
+    },
+
+    decode(payload) {
+      if (typeof payload === "string") {
+        return JSON.parse(payload);
+      }
+      return renameKeys(unpack(payload), LONG_KEYS);
+    },
+  };
+})();
@@ -1,3 +1,1394 @@
-from django.test import TestCase
+import asyncio
+import csv
+import inspect
+import json
+import os
+import re
+import time
+import uuid
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from .activity import PresenceDebouncer, TypingTracker, presence_debouncer
+from .broadcast_utils import GROUP_SEND_LUA, group_send_many
+from .consumers import ChatConsumer
+from .connections import MemoryConnectionRegistry, RedisConnectionRegistry, presence_registry
+from .frames import MSGPACK_PROTOCOL, SHORT_KEYS, decode_msgpack, encode_msgpack
+from .models import ChatRoom, Conversation, GroupChat, Message, PrivateChat
+from .routing import websocket_urlpatterns
+from friends.models import FriendRequest
+from notifications.consumers import NotificationConsumer
+from notifications.last_seen import last_seen_buffer
+from notifications.presence import PresenceSweeper, presence_aggregator, sweep_presence
+from notifications.utils import update_user_online_status
+from .utils import (
+    INCR_EXISTING_LUA, _increment_unread_totals, add_conversations, co_member_ids, create_message,
+    get_or_create_private_room, get_unread_total, mark_room_read, unread_total_key)
+from .sidebar import SidebarContext
+
+
+class RoomsContextQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="owner", email="owner@example.com", password="pw")
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+
+    def add_rooms(self, count):
+        """Add `count` rooms for the user, alternating private and group chats."""
+        start = ChatRoom.objects.count()
+        others = CustomUser.objects.bulk_create([
+            CustomUser(username=f"user{start + i}", email=f"user{start + i}@example.com")
+            for i in range(count)
+        ])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(name=f"room{start + i}") for i in range(count)
+        ])
+
+        Membership = ChatRoom.users.through
+        Membership.objects.bulk_create(
+            [Membership(chatroom=room, customuser=self.user) for room in rooms]
+            + [Membership(chatroom=room, customuser=other) for room, other in zip(rooms, others)]
+        )
+        PrivateChat.objects.bulk_create([
+            PrivateChat(room=room, user_a=self.user, user_b=other)
+            for room, other in zip(rooms[::2], others[::2])
+        ])
+        GroupChat.objects.bulk_create([
+            GroupChat(room=room, name=room.name, admin=self.user) for room in rooms[1::2]
+        ])
+        last_messages = Message.objects.bulk_create([
+            Message(room=room, user=other, content="hello")
+            for room, other in zip(rooms, others)
+        ])
+        Conversation.objects.bulk_create([
+            Conversation(
+                user=self.user, room=room,
+                last_activity_at=message.timestamp, unread_count=1)
+            for room, message in zip(rooms, last_messages)
+        ])
+        call_command("backfill_room_activity", stdout=StringIO())
+
+    def count_sidebar_queries(self):
+        sidebar = SidebarContext(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            render_to_string("chat/partials/sidebar_chat.html", {
+                "rooms": sidebar.rooms,
+                "has_more_rooms": sidebar.has_more_rooms,
+                "request": self.request,
+            })
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        self.add_rooms(10)
+        queries_for_10 = self.count_sidebar_queries()
+
+        self.add_rooms(990)
+        self.assertEqual(self.count_sidebar_queries(), queries_for_10)
+
+
+class HotViewTestCase(TestCase):
+    """A user with friends, a pending request, a private room and a group room."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = (
+            CustomUser.objects.create_user(
+                username=name, email=f"{name}@example.com", password="pw")
+            for name in ("alice", "bob", "carol")
+        )
+        for friend in (self.bob, self.carol):
+            FriendRequest.objects.create(from_user=self.alice, to_user=friend, is_accepted=True)
+        FriendRequest.objects.create(
+            from_user=CustomUser.objects.create_user(
+                username="dave", email="dave@example.com", password="pw"),
+            to_user=self.alice,
+        )
+
+        self.private_room, _ = get_or_create_private_room(self.alice, self.bob)
+        self.group_room = ChatRoom.objects.create(name="group")
+        GroupChat.objects.create(room=self.group_room, name="Group", admin=self.alice)
+        self.group_room.users.add(self.alice, self.bob)
+        add_conversations(self.group_room, [self.alice, self.bob])
+        for room in (self.private_room, self.group_room):
+            create_message(room=room, user=self.bob, content="hello")
+
+        self.client.force_login(self.alice)
+
+
+class ConversationTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        # Start from nothing unread
+        for room in (self.private_room, self.group_room):
+            mark_room_read(self.alice, room)
+        self.rooms = []
+        for name in ("first", "second"):
+            room = ChatRoom.objects.create(name=name)
+            room.users.add(self.alice, self.bob, self.carol)
+            add_conversations(room, [self.alice, self.bob, self.carol])
+            self.rooms.append(room)
+
+    def send(self, room, user, content="hello"):
+        return create_message(room=room, user=user, content=content)
+
+    def test_new_message_moves_room_to_top(self):
+        first, second = self.rooms
+        self.send(second, self.bob)
+        message = self.send(first, self.bob)
+
+        rooms = SidebarContext(self.alice).rooms()
+        self.assertEqual([entry["room"] for entry in rooms[:2]], [first, second])
+        self.assertEqual(rooms[0]["last_message"], message)
+
+    def test_unread_count_skips_sender_and_resets_on_read(self):
+        room = self.rooms[0]
+        self.send(room, self.bob)
+        self.send(room, self.bob)
+
+        counts = dict(Conversation.objects.filter(room=room).values_list("user", "unread_count"))
+        self.assertEqual(counts, {self.alice.id: 2, self.bob.id: 0, self.carol.id: 2})
+
+        mark_room_read(self.alice, room)
+        self.assertEqual(Conversation.objects.get(room=room, user=self.alice).unread_count, 0)
+
+    def test_unread_total_is_cached_and_kept_current(self):
+        room = self.rooms[0]
+        self.send(room, self.bob)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_total(self.alice), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_total(self.alice), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send(room, self.bob)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_total(self.alice), 2)
+        self.assertEqual(get_unread_total(self.bob), 0)
+
+        mark_room_read(self.alice, room)
+        self.assertEqual(get_unread_total(self.alice), 0)
+
+    def test_unread_totals_are_incremented_in_one_redis_call(self):
+        backend = RedisCache("redis://localhost:6379", {})
+        client = mock.Mock()
+        with mock.patch("chat.utils.caches", {"default": backend}), \
+                mock.patch.object(backend._cache, "get_client", return_value=client):
+            _increment_unread_totals([self.alice.id, self.carol.id])
+
+        client.eval.assert_called_once_with(
+            INCR_EXISTING_LUA, 2,
+            backend.make_key(unread_total_key(self.alice.id)),
+            backend.make_key(unread_total_key(self.carol.id)))
+
+    def test_room_points_at_newest_message(self):
+        room = self.rooms[0]
+        self.send(room, self.bob)
+        message = self.send(room, self.carol)
+
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, message)
+        self.assertEqual(room.last_activity_at, message.timestamp)
+
+        ChatRoom.objects.update(last_message=None, last_activity_at=None)
+        call_command("backfill_room_activity", stdout=StringIO())
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, message)
+
+        # Rooms without messages fall back to their creation time
+        empty_room = self.rooms[1]
+        empty_room.refresh_from_db()
+        self.assertEqual(empty_room.last_activity_at, empty_room.created_at)
+
+    def test_conversation_list_pages_after_cursor(self):
+        first, second = self.rooms
+        self.send(first, self.bob)
+        newest = Conversation.objects.get(room=first, user=self.alice)
+
+        response = self.client.get("/chat/conversations/", {
+            "before": newest.last_activity_at.isoformat(),
+            "before_id": newest.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'data-room="{second.room_id}"', response.json()["html"])
+        self.assertNotIn(f'data-room="{first.room_id}"', response.json()["html"])
+        self.assertFalse(response.json()["has_more"])
+
+
+class ViewQueryCountTests(HotViewTestCase):
+    # Session and user lookups, then each sidebar piece exactly once
+    def test_index(self):
+        with self.assertNumQueries(5):
+            self.client.get("/chat/")
+
+    def test_private_room(self):
+        with self.assertNumQueries(9):
+            self.client.get(f"/chat/{self.private_room.name}/")
+
+    def test_group_room(self):
+        # The friends list is shared by the add member list and the sidebar
+        with self.assertNumQueries(8):
+            self.client.get(f"/chat/{self.group_room.name}/")
+
+
+class OnlineStatusTests(HotViewTestCase):
+    def test_co_members_in_one_distinct_query(self):
+        # Bob shares both rooms with alice but is listed once
+        with self.assertNumQueries(1):
+            self.assertEqual(list(co_member_ids(self.alice)), [self.bob.id])
+
+    def test_update_status_publishes_presence(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f"presence_{self.alice.id}", channel)
+
+        CustomUser.objects.filter(pk=self.alice.pk).update(is_online=True)
+
+        # Session, user and the is_online write
+        with self.assertNumQueries(3):
+            self.client.post(
+                "/chat/update-status/", '{"is_online": false}', content_type="application/json")
+
+        message = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(message, {
+            "type": "presence.change", "user_id": self.alice.id, "is_online": False})
+
+
+@override_settings(CHAT_PRESENCE_BATCH_INTERVAL=0.05)
+class PresenceTests(HotViewTestCase):
+    GRACE_PERIOD = 0.2
+
+    def setUp(self):
+        super().setUp()
+        grace_period = presence_aggregator.grace_period
+        presence_aggregator.grace_period = self.GRACE_PERIOD
+        self.addCleanup(setattr, presence_aggregator, "grace_period", grace_period)
+        # Write socket activity while this test's users still exist
+        self.addCleanup(last_seen_buffer.flush)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def subscribe(self, communicator, *users):
+        """Follow the users; returns the statuses sent back for them."""
+        await communicator.send_json_to({
+            "type": "presence_subscribe",
+            "data": {"user_ids": [user.id for user in users]},
+        })
+        if await communicator.receive_nothing():
+            return []
+        return (await communicator.receive_json_from())["statuses"]
+
+    async def settle(self):
+        """Wait until held changes are applied and their batches sent."""
+        await asyncio.sleep(self.GRACE_PERIOD + 0.2)
+
+    async def is_online(self, user):
+        return (await CustomUser.objects.aget(pk=user.pk)).is_online
+
+    async def test_online_until_last_connection_closes(self):
+        bob = await self.connect(self.bob)
+        self.assertEqual(
+            await self.subscribe(bob, self.alice),
+            [{"user_id": self.alice.id, "is_online": False}])
+
+        first = await self.connect(self.alice)
+        second = await self.connect(self.alice)
+        await self.settle()
+        batch = await bob.receive_json_from()
+        self.assertEqual(batch["event"], "status_batch")
+        self.assertEqual(batch["statuses"], [{"user_id": self.alice.id, "is_online": True}])
+
+        await first.disconnect()
+        await self.settle()
+        self.assertTrue(await self.is_online(self.alice))
+        self.assertTrue(await bob.receive_nothing())
+
+        await second.disconnect()
+        await self.settle()
+        self.assertFalse(await self.is_online(self.alice))
+        self.assertFalse((await bob.receive_json_from())["statuses"][0]["is_online"])
+        await bob.disconnect()
+        await self.settle()
+
+    async def test_refresh_within_grace_period_is_not_seen(self):
+        bob = await self.connect(self.bob)
+        await self.subscribe(bob, self.alice)
+        alice = await self.connect(self.alice)
+        await self.settle()
+        await bob.receive_json_from()
+
+        await alice.disconnect()
+        alice = await self.connect(self.alice)
+        await self.settle()
+        self.assertTrue(await bob.receive_nothing())
+        self.assertTrue(await self.is_online(self.alice))
+
+        await alice.disconnect()
+        await bob.disconnect()
+        await self.settle()
+
+    async def test_sweep_does_not_race_a_reconnect(self):
+        alice = await self.connect(self.alice)
+        await self.settle()
+        self.assertTrue(await self.is_online(self.alice))
+
+        # The offline change is held, so the sweep leaves alice alone
+        await alice.disconnect()
+        self.assertEqual(await sweep_presence(), [])
+        self.assertTrue(await self.is_online(self.alice))
+
+        # A flag written offline meanwhile is repaired by the flap
+        await CustomUser.objects.filter(pk=self.alice.pk).aupdate(is_online=False)
+        alice = await self.connect(self.alice)
+        await self.settle()
+        self.assertTrue(await self.is_online(self.alice))
+
+        await alice.disconnect()
+        await self.settle()
+
+    async def test_only_subscribed_co_members_are_sent(self):
+        dave = await CustomUser.objects.aget(username="dave")
+        bob = await self.connect(self.bob)
+        # Dave shares no room with bob
+        statuses = await self.subscribe(bob, self.alice, dave)
+        self.assertEqual([status["user_id"] for status in statuses], [self.alice.id])
+
+        self.assertEqual(await self.subscribe(bob), [])
+        alice = await self.connect(self.alice)
+        await self.settle()
+        self.assertTrue(await bob.receive_nothing())
+
+        await alice.disconnect()
+        await bob.disconnect()
+        await self.settle()
+
+    async def test_change_during_subscribe_is_not_lost(self):
+        bob = await self.connect(self.bob)
+        read_presence = NotificationConsumer.read_presence
+
+        async def read_then_change(consumer, user_ids):
+            # Alice comes online right after her status was read
+            statuses = await read_presence(consumer, user_ids)
+            await update_user_online_status(self.alice, True)
+            return statuses
+
+        with mock.patch.object(NotificationConsumer, "read_presence", read_then_change):
+            self.assertEqual(
+                await self.subscribe(bob, self.alice),
+                [{"user_id": self.alice.id, "is_online": False}])
+        await self.settle()
+        self.assertEqual(
+            (await bob.receive_json_from())["statuses"],
+            [{"user_id": self.alice.id, "is_online": True}])
+
+        await bob.disconnect()
+        await self.settle()
+
+    async def test_socket_activity_updates_last_seen(self):
+        alice = await self.connect(self.alice)
+        await alice.disconnect()
+        await self.settle()
+        self.assertIsNone((await CustomUser.objects.aget(pk=self.alice.pk)).last_seen)
+
+        await last_seen_buffer.aflush()
+        self.assertIsNotNone((await CustomUser.objects.aget(pk=self.alice.pk)).last_seen)
+
+    async def test_sweep_checks_the_registry_once_per_batch(self):
+        await CustomUser.objects.filter(
+            pk__in=[self.alice.pk, self.bob.pk, self.carol.pk]).aupdate(is_online=True)
+        with mock.patch.object(
+                presence_registry, "members_many", wraps=presence_registry.members_many) as lookup:
+            swept = await sweep_presence()
+        self.assertEqual(sorted(swept), sorted([self.alice.id, self.bob.id, self.carol.id]))
+        lookup.assert_called_once()
+
+    async def test_one_process_sweeps_per_interval(self):
+        await CustomUser.objects.filter(pk=self.alice.pk).aupdate(is_online=True)
+        sweeper = PresenceSweeper(60)
+        # Another worker already claimed this interval
+        with mock.patch.object(presence_registry, "claim", return_value=False):
+            self.assertIsNone(await sweeper.sweep())
+        self.assertTrue(await self.is_online(self.alice))
+
+        self.assertEqual(await sweeper.sweep(), [self.alice.id])
+
+    def test_sweep_command_needs_a_shared_registry(self):
+        CustomUser.objects.filter(pk=self.alice.pk).update(is_online=True)
+        # The tests run without REDIS_URL, so the registry is per process
+        with self.assertRaises(CommandError):
+            call_command("sweep_presence", stdout=StringIO())
+        self.assertTrue(CustomUser.objects.get(pk=self.alice.pk).is_online)
+
+        call_command("sweep_presence", "--force", stdout=StringIO())
+        self.assertFalse(CustomUser.objects.get(pk=self.alice.pk).is_online)
+
+    async def test_sweep_takes_users_without_connections_offline(self):
+        await CustomUser.objects.filter(pk=self.alice.pk).aupdate(is_online=True)
+        bob = await self.connect(self.bob)
+        await self.subscribe(bob, self.alice)
+        await self.settle()
+
+        self.assertEqual(await sweep_presence(), [self.alice.id])
+        self.assertFalse(await self.is_online(self.alice))
+        self.assertTrue(await self.is_online(self.bob))
+        await self.settle()
+        self.assertEqual(
+            (await bob.receive_json_from())["statuses"],
+            [{"user_id": self.alice.id, "is_online": False}])
+        await bob.disconnect()
+        await self.settle()
+
+
+class FakeRedisPipeline:
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def zremrangebyscore(self, key, min, max):
+        self.commands.append(("zremrangebyscore", key))
+
+    def zrange(self, key, start, end):
+        self.commands.append(("zrange", key))
+
+    def eval(self, script, numkeys, *args):
+        self.commands.append(("eval", script, args[:numkeys], args[numkeys:]))
+
+    async def execute(self):
+        self.connection.pipelines.append(self.commands)
+        return [self.connection.reply(command) for command in self.commands]
+
+
+class FakeRedisConnection:
+    """Answers zrange from `groups` and reports every delivery over capacity."""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.pipelines = []
+
+    def pipeline(self):
+        return FakeRedisPipeline(self)
+
+    def reply(self, command):
+        match command:
+            case ("zrange", key):
+                return [name.encode("utf8") for name in self.groups.get(key, [])]
+            case ("eval", _, keys, _):
+                return len(keys)
+        return 0
+
+
+class RedisConnectionRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = RedisConnectionRegistry("presence", 60, "redis://localhost:6379")
+        self.client = mock.Mock()
+        self.client.set = mock.AsyncMock(side_effect=[True, None])
+        pipe = self.client.pipeline.return_value
+        pipe.execute = mock.AsyncMock(return_value=[[b"1|a", b"1|b"], []])
+        self.registry._client = lambda: self.client
+
+    async def test_members_many_is_one_pipeline(self):
+        connections = await self.registry.members_many([1, 2])
+        self.assertEqual(connections[1][1], 2)
+        self.assertEqual(connections[2][2], 0)
+        self.client.pipeline.assert_called_once()
+        self.assertEqual(
+            [call.args[0] for call in self.client.pipeline.return_value.zrangebyscore.call_args_list],
+            ["connections:presence:1", "connections:presence:2"])
+
+    async def test_claim_is_held_until_it_expires(self):
+        self.assertTrue(await self.registry.claim("sweep", 60))
+        self.assertFalse(await self.registry.claim("sweep", 60))
+        self.client.set.assert_called_with(
+            "connections:presence:claim:sweep", 1, nx=True, ex=60)
+
+
+class RedisGroupSendManyTests(SimpleTestCase):
+    """group_send_many against a RedisChannelLayer whose connections are stubbed."""
+
+    def setUp(self):
+        self.layer = RedisChannelLayer(hosts=["redis://one:6379", "redis://two:6379"])
+        # Spread over both connections
+        groups = [f"notification_{user_id}" for user_id in range(12)]
+        self.groups = groups
+        members = {
+            self.layer._group_key(group): [f"specific.{group}!1", f"specific.{group}!2"]
+            for group in groups
+        }
+        self.connections = [FakeRedisConnection(members), FakeRedisConnection(members)]
+        self.layer.connection = lambda index: self.connections[index]
+        patcher = mock.patch("chat.broadcast_utils.get_channel", return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_one_lookup_and_one_delivery_pipeline_per_connection(self):
+        with self.assertLogs("chat.broadcast_utils", "INFO") as logs:
+            await group_send_many(self.groups, {"type": "notify", "data": {}})
+
+        delivered = set()
+        for redis_connection in self.connections:
+            lookup, delivery = redis_connection.pipelines
+            self.assertEqual({command[0] for command in lookup}, {"zremrangebyscore", "zrange"})
+            self.assertEqual(delivery[-1][0], "eval")
+            self.assertEqual(delivery[-1][1], GROUP_SEND_LUA)
+            delivered.update(delivery[-1][2])
+
+        # Both channels of a group share one per-process key
+        self.assertEqual(delivered, {
+            self.layer.prefix + f"specific.{group}!" for group in self.groups})
+        self.assertIn("12 of 24 channels over capacity in 12 groups", logs.output[0])
+
+    def test_script_matches_channels_redis(self):
+        # Copied from RedisChannelLayer.group_send (channels_redis 4.2.1)
+        source = " ".join(inspect.getsource(RedisChannelLayer.group_send).split())
+        self.assertIn(" ".join(GROUP_SEND_LUA.split()), source)
+
+
+class ChatConsumerTestCase(HotViewTestCase):
+    """Chat sockets on the fixture's rooms, with presence timers kept short."""
+    application = URLRouter(websocket_urlpatterns)
+    LEAVE_GRACE_PERIOD = 0.05
+
+    def setUp(self):
+        super().setUp()
+        grace_period = presence_debouncer.grace_period
+        presence_debouncer.grace_period = self.LEAVE_GRACE_PERIOD
+        self.addCleanup(setattr, presence_debouncer, "grace_period", grace_period)
+        self.addCleanup(last_seen_buffer.flush)
+
+    async def connect(self, user, room, subprotocols=None):
+        communicator = WebsocketCommunicator(
+            self.application, f"/ws/chat/{room.name}/", subprotocols=subprotocols)
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def make_consumer(self, user, room):
+        """A bare consumer, for driving handlers that crash the socket."""
+        consumer = ChatConsumer()
+        consumer.scope = {"url_route": {"kwargs": {"room_name": room.name}}, "user": user}
+        consumer.channel_layer = get_channel_layer()
+        consumer.channel_name = await consumer.channel_layer.new_channel()
+        consumer.base_send = mock.AsyncMock()
+        return consumer
+
+    async def receive_all(self, communicator):
+        """Every JSON frame the socket has been sent so far."""
+        frames = []
+        while not await communicator.receive_nothing(0.05):
+            frames.append(await communicator.receive_json_from())
+        return frames
+
+    async def send_message(self, communicator, message, client_id=None):
+        await communicator.send_json_to({
+            "type": "message",
+            "data": {"message": message, "client_id": client_id},
+        })
+
+    async def disconnect(self, *communicators):
+        for communicator in communicators:
+            await communicator.disconnect()
+        # Let held leaves go out before the test's event loop closes
+        await asyncio.sleep(self.LEAVE_GRACE_PERIOD + 0.05)
+
+
+class ChatConsumerSendTests(ChatConsumerTestCase):
+    async def test_send_acks_stores_and_fans_out(self):
+        channel_layer = get_channel_layer()
+        notifications = await channel_layer.new_channel()
+        await channel_layer.group_add(f"notification_{self.alice.id}", notifications)
+
+        bob = await self.connect(self.bob, self.private_room)
+        alice = await self.connect(self.alice, self.private_room)
+        await self.receive_all(bob)
+        await self.receive_all(alice)
+
+        await self.send_message(bob, "hi alice")
+        ack, echo = await self.receive_all(bob)
+        self.assertEqual(ack["event"], "message_ack")
+        self.assertEqual(echo["message"], "hi alice")
+        self.assertEqual(echo["id"], ack["id"])
+        self.assertEqual(await self.receive_all(alice), [echo])
+
+        notification = await channel_layer.receive(notifications)
+        self.assertEqual(notification["data"]["event"], "new_message")
+        self.assertEqual(notification["data"]["content"], "hi alice")
+        self.assertEqual(
+            await Message.objects.filter(room=self.private_room, content="hi alice").acount(), 1)
+
+        await self.disconnect(alice, bob)
+
+
+class ChatConsumerMembershipTests(ChatConsumerTestCase):
+    async def test_non_member_is_denied_before_joining_the_group(self):
+        communicator = WebsocketCommunicator(
+            self.application, f"/ws/chat/{self.private_room.name}/")
+        communicator.scope["user"] = self.carol
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertFalse(get_channel_layer().groups.get(f"chat_{self.private_room.name}"))
+
+    async def test_unknown_room_is_denied(self):
+        communicator = WebsocketCommunicator(self.application, "/ws/chat/missing/")
+        communicator.scope["user"] = self.alice
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_disconnect_after_failed_connect(self):
+        consumer = await self.make_consumer(self.alice, self.private_room)
+
+        # The room is resolved, but the heartbeat never starts
+        with mock.patch("chat.consumers.amark_room_read", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await consumer.connect()
+
+        await consumer.disconnect(1011)
+        self.assertFalse(consumer.channel_layer.groups.get(f"chat_{self.private_room.name}"))
+
+    async def test_group_update_keeps_member_cache_current(self):
+        channel_layer = get_channel_layer()
+        notifications = await channel_layer.new_channel()
+        await channel_layer.group_add(f"notification_{self.carol.id}", notifications)
+
+        alice = await self.connect(self.alice, self.group_room)
+        bob = await self.connect(self.bob, self.group_room)
+        await self.receive_all(alice)
+        await self.receive_all(bob)
+
+        group = f"chat_{self.group_room.name}"
+        await channel_layer.group_send(group, {
+            "type": "group_update",
+            "data": {"event_type": "member_added", "user_id": self.carol.id},
+        })
+        await channel_layer.group_send(group, {
+            "type": "group_update",
+            "data": {"event_type": "member_kicked", "user_id": self.bob.id},
+        })
+
+        # The kicked user's socket is told, then closed
+        self.assertEqual(
+            (await bob.receive_json_from())["event_type"], "member_added")
+        self.assertEqual(
+            (await bob.receive_json_from())["event_type"], "member_kicked")
+        self.assertEqual((await bob.receive_output())["type"], "websocket.close")
+        await self.receive_all(alice)
+
+        # Sends use the updated member set without querying it again
+        await self.send_message(alice, "welcome carol")
+        await self.receive_all(alice)
+        notification = await channel_layer.receive(notifications)
+        self.assertEqual(notification["data"]["content"], "welcome carol")
+
+        await self.disconnect(alice, bob)
+
+
+class ChatConsumerPresenceTests(ChatConsumerTestCase):
+    LEAVE_GRACE_PERIOD = 0.3
+
+    def activity(self, frames):
+        return [
+            frame["event"] for frame in frames
+            if frame.get("event") in ("user_join", "user_leave")
+        ]
+
+    async def test_join_is_sent_on_connect(self):
+        alice = await self.connect(self.alice, self.private_room)
+        await self.receive_all(alice)
+        bob = await self.connect(self.bob, self.private_room)
+        self.assertEqual(self.activity(await self.receive_all(alice)), ["user_join"])
+        await self.disconnect(alice, bob)
+
+    async def test_refresh_is_not_seen(self):
+        alice = await self.connect(self.alice, self.private_room)
+        bob = await self.connect(self.bob, self.private_room)
+        await self.receive_all(alice)
+
+        await bob.disconnect()
+        bob = await self.connect(self.bob, self.private_room)
+        await asyncio.sleep(self.LEAVE_GRACE_PERIOD + 0.05)
+        self.assertEqual(self.activity(await self.receive_all(alice)), [])
+
+        await self.disconnect(alice, bob)
+
+    async def test_leave_is_sent_after_grace_period(self):
+        alice = await self.connect(self.alice, self.private_room)
+        bob = await self.connect(self.bob, self.private_room)
+        await self.receive_all(alice)
+
+        await bob.disconnect()
+        self.assertEqual(self.activity(await self.receive_all(alice)), [])
+        await asyncio.sleep(self.LEAVE_GRACE_PERIOD)
+        self.assertEqual(self.activity(await self.receive_all(alice)), ["user_leave"])
+
+        await self.disconnect(alice)
+
+
+class ChatConsumerClientIdTests(ChatConsumerTestCase):
+    async def join(self):
+        self.bob_socket = await self.connect(self.bob, self.private_room)
+        self.alice_socket = await self.connect(self.alice, self.private_room)
+        await self.receive_all(self.bob_socket)
+        await self.receive_all(self.alice_socket)
+
+    async def test_duplicate_send_is_stored_once_and_only_acked(self):
+        await self.join()
+        client_id = str(uuid.uuid4())
+        await self.send_message(self.bob_socket, "once", client_id)
+        first_ack, _ = await self.receive_all(self.bob_socket)
+        await self.receive_all(self.alice_socket)
+
+        # A retry after a lost ack
+        await self.send_message(self.bob_socket, "once", client_id)
+        self.assertEqual(await self.receive_all(self.bob_socket), [first_ack])
+        self.assertEqual(await self.receive_all(self.alice_socket), [])
+        self.assertEqual(await Message.objects.filter(client_id=client_id).acount(), 1)
+
+        await self.disconnect(self.alice_socket, self.bob_socket)
+
+    async def test_invalid_client_id_is_ignored(self):
+        await self.join()
+        await self.send_message(self.bob_socket, "first", "not-a-uuid")
+        await self.send_message(self.bob_socket, "second", "not-a-uuid")
+        frames = await self.receive_all(self.bob_socket)
+
+        acks = [frame for frame in frames if frame.get("event") == "message_ack"]
+        self.assertEqual([ack["message"] for ack in acks], ["first", "second"])
+        self.assertEqual([ack["client_id"] for ack in acks], [None, None])
+        self.assertEqual(
+            await Message.objects.filter(user=self.bob, client_id__isnull=True,
+                                         content__in=["first", "second"]).acount(), 2)
+
+        await self.disconnect(self.alice_socket, self.bob_socket)
+
+    async def test_other_integrity_errors_are_not_acked(self):
+        consumer = await self.make_consumer(self.bob, self.private_room)
+        await consumer.connect()
+        sent = consumer.base_send.await_count
+
+        error = IntegrityError("NOT NULL constraint failed: chat_message.content")
+        try:
+            for client_id in [None, str(uuid.uuid4())]:
+                with self.subTest(client_id=client_id):
+                    frame = json.dumps({
+                        "type": "message",
+                        "data": {"message": "broken", "client_id": client_id},
+                    })
+                    with mock.patch("chat.consumers.create_message", side_effect=error):
+                        with self.assertRaises(IntegrityError):
+                            await consumer.receive(text_data=frame)
+        finally:
+            await consumer.disconnect(1011)
+            await asyncio.sleep(self.LEAVE_GRACE_PERIOD + 0.05)
+        self.assertEqual(consumer.base_send.await_count, sent)
+
+    async def test_ack_arrives_before_group_echo(self):
+        await self.join()
+        client_id = str(uuid.uuid4())
+        await self.send_message(self.bob_socket, "ordered", client_id)
+        ack, echo = await self.receive_all(self.bob_socket)
+
+        self.assertEqual(ack["event"], "message_ack")
+        self.assertNotIn("event", echo)
+        self.assertEqual(ack["client_id"], client_id)
+        self.assertEqual(echo["client_id"], client_id)
+
+        await self.disconnect(self.alice_socket, self.bob_socket)
+
+
+class MsgpackFrameTests(SimpleTestCase):
+    def test_round_trip_shortens_known_keys(self):
+        frame = {
+            "event": "status_batch",
+            "statuses": [{"user_id": 1, "is_online": True}],
+            "unlisted": {"content": None},
+        }
+        packed = encode_msgpack(frame)
+        self.assertEqual(decode_msgpack(packed), frame)
+        self.assertEqual(
+            msgpack.unpackb(packed),
+            {"e": "status_batch", "st": [{"ui": 1, "o": True}], "unlisted": {"ct": None}})
+
+    def test_short_keys_match_wire_js(self):
+        wire_js = (settings.BASE_DIR / "chat" / "static" / "chat" / "wire.js").read_text()
+        table = re.search(r"const SHORT_KEYS = \{(.*?)\};", wire_js, re.S).group(1)
+        self.assertEqual(dict(re.findall(r'(\w+): "(\w+)"', table)), SHORT_KEYS)
+
+    def test_short_keys_are_unique(self):
+        self.assertEqual(len(set(SHORT_KEYS.values())), len(SHORT_KEYS))
+
+
+class ChatConsumerMsgpackTests(ChatConsumerTestCase):
+    async def test_msgpack_subprotocol_is_negotiated(self):
+        communicator = WebsocketCommunicator(
+            self.application, f"/ws/chat/{self.private_room.name}/",
+            subprotocols=[MSGPACK_PROTOCOL])
+        communicator.scope["user"] = self.bob
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, MSGPACK_PROTOCOL)
+
+        viewers = decode_msgpack(await communicator.receive_from())
+        self.assertEqual(viewers["event"], "viewers")
+        while not await communicator.receive_nothing(0.05):
+            await communicator.receive_from()
+
+        await communicator.send_to(bytes_data=encode_msgpack(
+            {"type": "message", "data": {"message": "packed"}}))
+        ack = decode_msgpack(await communicator.receive_from())
+        self.assertEqual(ack["event"], "message_ack")
+        self.assertEqual(ack["message"], "packed")
+
+        await self.disconnect(communicator)
+
+    async def test_json_without_subprotocol(self):
+        communicator = await self.connect(self.bob, self.private_room)
+        self.assertEqual((await communicator.receive_json_from())["event"], "viewers")
+        await self.disconnect(communicator)
+
+
+class TypingTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.tracker = TypingTracker(self.broadcast, throttle=0.1, timeout=0.2)
+
+    async def broadcast(self, is_typing):
+        self.sent.append(is_typing)
+
+    async def test_repeated_reports_are_throttled(self):
+        for _ in range(5):
+            await self.tracker.update(True)
+        self.assertEqual(self.sent, [True])
+
+        await asyncio.sleep(0.12)
+        await self.tracker.update(True)
+        self.assertEqual(self.sent, [True, True])
+        await self.tracker.stop()
+
+    async def test_stop_is_broadcast_once(self):
+        await self.tracker.stop()
+        self.assertEqual(self.sent, [])
+
+        await self.tracker.update(True)
+        await self.tracker.update(False)
+        await self.tracker.stop()
+        self.assertEqual(self.sent, [True, False])
+
+    async def test_silence_clears_typing(self):
+        await self.tracker.update(True)
+        await asyncio.sleep(0.15)
+        # A report pushes the timeout back
+        await self.tracker.update(True)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.sent, [True, True])
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.sent, [True, True, False])
+        self.assertFalse(self.tracker.is_typing)
+
+
+class ChatConsumerTypingTests(ChatConsumerTestCase):
+    async def test_sending_a_message_ends_typing(self):
+        alice = await self.connect(self.alice, self.private_room)
+        bob = await self.connect(self.bob, self.private_room)
+        await self.receive_all(alice)
+        await self.receive_all(bob)
+
+        for _ in range(3):
+            await bob.send_json_to({"type": "typing", "data": {"is_typing": True}})
+        await self.send_message(bob, "done typing")
+
+        frames = await self.receive_all(alice)
+        typing = [frame["is_typing"] for frame in frames if frame.get("event") == "typing"]
+        self.assertEqual(typing, [True, False])
+        self.assertEqual(frames[-1]["message"], "done typing")
+
+        await self.disconnect(alice, bob)
+
+
+class PresenceDebouncerTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = MemoryConnectionRegistry("test", 60)
+        self.debouncer = PresenceDebouncer(0.05, self.registry)
+        self.left = []
+
+    async def broadcast(self):
+        self.left.append(True)
+
+    async def test_leave_is_broadcast_after_grace_period(self):
+        self.debouncer.schedule_leave("room", 1, self.broadcast)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.left, [True])
+
+    async def test_reconnect_cancels_leave(self):
+        self.debouncer.schedule_leave("room", 1, self.broadcast)
+        self.assertTrue(self.debouncer.cancel_leave("room", 1))
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.left, [])
+
+    async def test_reconnect_through_another_worker_skips_leave(self):
+        self.debouncer.schedule_leave("room", 1, self.broadcast)
+        # Registered by a worker this debouncer knows nothing about
+        await self.registry.add("room", 1, "other-worker-channel")
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.left, [])
+
+
+class LastSeenTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        last_seen_buffer.flush()
+
+    def test_flush_writes_activity_in_one_update(self):
+        for _ in range(100):
+            last_seen_buffer.touch(self.alice.id)
+            last_seen_buffer.touch(self.bob.id)
+        self.assertIsNone(CustomUser.objects.get(pk=self.alice.pk).last_seen)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(last_seen_buffer.flush(), 2)
+        self.assertEqual(
+            CustomUser.objects.filter(last_seen__isnull=False).count(), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(last_seen_buffer.flush(), 0)
+
+    def test_full_buffer_is_flushed_early(self):
+        max_pending = last_seen_buffer.max_pending
+        last_seen_buffer.max_pending = 2
+        self.addCleanup(setattr, last_seen_buffer, "max_pending", max_pending)
+
+        last_seen_buffer.touch(self.alice.id)
+        self.assertIsNone(CustomUser.objects.get(pk=self.alice.pk).last_seen)
+        last_seen_buffer.touch(self.bob.id)
+        self.assertIsNotNone(CustomUser.objects.get(pk=self.alice.pk).last_seen)
+
+
+class QueryPlanTests(HotViewTestCase):
+    """
+    Run every query a hot view makes through EXPLAIN and fail when one of
+    them has to walk a whole table instead of searching an index.
+    """
+
+    # SQLite: "SCAN chat_message" (optionally "USING INDEX ...") is a full
+    # walk, "SEARCH chat_message USING INDEX ..." is a lookup.
+    # PostgreSQL: "Seq Scan on chat_message".
+    FULL_SCAN = re.compile(r"^SCAN (\w+)|Seq Scan on (\w+)")
+
+    def capture(self, path):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [(sql, params) for sql, params in statements if sql.startswith("SELECT")]
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables are cheaper to scan; only complain when
+                # the planner has no usable index at all
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("EXPLAIN " + sql, params)
+            else:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1].strip() for row in cursor.fetchall()]
+
+    def assertNoFullScans(self, path):
+        for sql, params in self.capture(path):
+            plan = self.explain(sql, params)
+            scans = [line for line in plan if self.FULL_SCAN.search(line)]
+            self.assertFalse(scans, f"{path} scans a table:\n{sql}\n" + "\n".join(plan))
+
+    def test_index(self):
+        self.assertNoFullScans("/chat/")
+
+    def test_rooms(self):
+        self.assertNoFullScans(f"/chat/{self.private_room.name}/")
+        self.assertNoFullScans(f"/chat/{self.group_room.name}/")
+
+    def test_history_and_sidebar_pages(self):
+        newest = self.group_room.messages.latest("id")
+        self.assertNoFullScans(f"/chat/messages/{self.group_room.name}/?before={newest.id}")
+        self.assertNoFullScans("/chat/conversations/?before=2100-01-01T00:00:00%2B00:00&before_id=1")
+        self.assertNoFullScans(f"/chat/messages/{self.group_room.name}/sync/?since={newest.id}")
+
+    def test_history_page_seeks_to_cursor(self):
+        newest = self.group_room.messages.latest("id")
+        statements = self.capture(f"/chat/messages/{self.group_room.name}/?before={newest.id}")
+        [(sql, params)] = [(sql, params) for sql, params in statements if "ORDER BY" in sql]
+        # The index range starts at the cursor instead of the newest message
+        plan = "\n".join(self.explain(sql, params))
+        self.assertRegex(plan, r"timestamp\"?\s*<", plan)
+
+    def test_friend_pages(self):
+        self.assertNoFullScans("/friends/")
+        self.assertNoFullScans("/friends/requests/")
+
+
+class MessageFragmentCacheTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="cached")
+        GroupChat.objects.create(room=self.room, name="Cached", admin=self.alice)
+        self.room.users.add(self.alice, self.bob)
+        self.message = create_message(room=self.room, user=self.alice, content="original")
+
+    def render_room(self, user):
+        self.client.force_login(user)
+        return self.client.get(f"/chat/{self.room.name}/").content.decode()
+
+    def test_bubble_is_shared_until_edited(self):
+        self.assertIn("original", self.render_room(self.alice))
+
+        # Not an edit, so the cached bubble is still served, with bob's own
+        # per-viewer parts around it
+        Message.objects.filter(pk=self.message.pk).update(content="sneaky")
+        page = self.render_room(self.bob)
+        self.assertIn("original", page)
+        self.assertIn('class="message received"', page)
+        self.assertNotIn("btn-edit", page)
+
+        self.message.content = "changed"
+        self.message.edited_at = timezone.now()
+        self.message.save()
+        self.assertIn("changed", self.render_room(self.alice))
+
+    def test_page_fetches_all_bubbles_at_once(self):
+        for i in range(5):
+            create_message(room=self.room, user=self.bob, content=f"more {i}")
+        self.render_room(self.alice)
+
+        with mock.patch("chat.utils.cache", wraps=cache) as fragment_cache:
+            self.render_room(self.bob)
+        fragment_cache.get_many.assert_called_once()
+        fragment_cache.set_many.assert_not_called()
+
+
+class MessagePaginationTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="history")
+        self.room.users.add(self.alice)
+        # Same-timestamp pairs make sure the id tiebreak is honoured
+        now = timezone.now()
+        self.messages = Message.objects.bulk_create([
+            Message(room=self.room, user=self.alice, content=str(i)) for i in range(45)
+        ])
+        for i, message in enumerate(self.messages):
+            message.timestamp = now + timedelta(seconds=i // 2)
+        Message.objects.bulk_update(self.messages, ["timestamp"])
+
+    def get_page(self, **params):
+        response = self.client.get(f"/chat/messages/{self.room.name}/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_before_walks_the_whole_history(self):
+        page = self.get_page()
+        ids = [message["id"] for message in page["messages"]]
+        while page["has_more"]:
+            page = self.get_page(before=ids[-1])
+            ids += [message["id"] for message in page["messages"]]
+
+        self.assertEqual(ids, [message.id for message in reversed(self.messages)])
+
+    def test_after_returns_the_next_newer_page(self):
+        page = self.get_page(after=self.messages[9].id)
+        self.assertEqual(
+            [message["id"] for message in page["messages"]],
+            [message.id for message in reversed(self.messages[10:30])])
+        self.assertTrue(page["has_more"])
+
+    def test_new_messages_do_not_shift_pages(self):
+        first_page = self.get_page()
+        create_message(room=self.room, user=self.alice, content="new")
+        second_page = self.get_page(before=first_page["messages"][-1]["id"])
+        self.assertEqual(second_page["messages"][0]["id"], self.messages[24].id)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"/chat/messages/{self.room.name}/", {"before": "nope"})
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageSyncTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="sync")
+        self.room.users.add(self.alice, self.bob)
+        self.old, self.edited, self.deleted = (
+            create_message(room=self.room, user=self.bob, content=str(i)) for i in range(3))
+        # Older than the sync overlap, so only real changes come back
+        Message.objects.update(timestamp=F("timestamp") - timedelta(minutes=10),
+                               updated_at=F("updated_at") - timedelta(minutes=10))
+        self.cursor = timezone.now()
+
+        self.edited.content = "changed"
+        self.edited.edited_at = timezone.now()
+        self.edited.save()
+        self.deleted.is_delete = True
+        self.deleted.save()
+        self.new = create_message(room=self.room, user=self.bob, content="new")
+
+    def sync(self, since, **headers):
+        return self.client.get(
+            f"/chat/messages/{self.room.name}/sync/", {"since": since}, headers=headers)
+
+    def test_returns_created_edited_and_deleted(self):
+        data = self.sync(self.cursor.isoformat()).json()
+        self.assertEqual(
+            [(message["id"], message["edited"]) for message in data["messages"]],
+            [(self.edited.id, True), (self.new.id, False)])
+        self.assertEqual(data["deleted"], [self.deleted.id])
+        self.assertFalse(data["has_more"])
+
+    def test_unchanged_room_is_not_modified(self):
+        cursor = self.sync(self.cursor.isoformat()).json()["cursor"]
+        response = self.sync(cursor)
+        self.assertEqual(response.json()["cursor"], cursor)
+        self.assertEqual(self.sync(cursor, if_none_match=response["ETag"]).status_code, 304)
+
+        create_message(room=self.room, user=self.bob, content="newer")
+        self.assertEqual(self.sync(cursor, if_none_match=response["ETag"]).status_code, 200)
+
+    def test_etag_depends_on_since(self):
+        response = self.sync(self.cursor.isoformat())
+        earlier = self.sync(
+            (self.cursor - timedelta(days=1)).isoformat(), if_none_match=response["ETag"])
+        self.assertEqual(earlier.status_code, 200)
+        self.assertNotEqual(earlier["ETag"], response["ETag"])
+
+    def test_invalid_since(self):
+        self.assertEqual(self.sync("yesterday").status_code, 400)
+
+
+class RoomExportTests(HotViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="archive")
+        self.room.users.add(self.alice)
+        self.text = create_message(room=self.room, user=self.alice, content="hello")
+        self.upload = create_message(
+            room=self.room, user=self.alice, content="/media/chat_uploads/a.png", is_file=True)
+        Message.objects.filter(pk=self.text.pk).update(timestamp=timezone.now() - timedelta(days=3))
+        self.async_client.force_login(self.alice)
+
+    def export(self, **params):
+        response = async_to_sync(self.async_client.get)(f"/chat/export/{self.room.name}/", params)
+        self.assertEqual(response.status_code, 200)
+
+        async def read():
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        return async_to_sync(read)().decode()
+
+    async def test_streams_without_buffering(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            response = await self.async_client.get(f"/chat/export/{self.room.name}/")
+            self.assertTrue(response.is_async)
+            lines = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(lines), 2)
+        # Django warns when it has to read a sync iterator into memory
+        self.assertFalse([w for w in caught if "StreamingHttpResponse" in str(w.message)])
+
+    def test_ndjson_with_date_range(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.text.id, self.upload.id])
+        self.assertEqual(rows[1]["attachment_url"], "http://testserver/media/chat_uploads/a.png")
+
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        rows = [json.loads(line) for line in self.export(start=since).splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.upload.id])
+
+    def test_csv_and_command(self):
+        rows = list(csv.DictReader(self.export(format="csv").splitlines()))
+        self.assertEqual(rows[0]["content"], "hello")
+
+        out = StringIO()
+        call_command(
+            "export_room", self.room.name, "--format", "csv",
+            "--base-url", "http://testserver", stdout=out)
+        self.assertEqual(out.getvalue(), self.export(format="csv"))
+
+
+@tag("benchmark")
+@skipUnless(os.environ.get("CHAT_BENCHMARKS"), "set CHAT_BENCHMARKS=1 to run benchmarks")
+class BenchmarkMixin:
+    """
+    Timing runs, skipped by default. Run them with
+
+        CHAT_BENCHMARKS=1 python manage.py test chat --tag benchmark
+
+    Each prints a table; absolute numbers depend on the machine, the
+    shape across rows is what they check.
+    """
+
+    def add_members(self, room, count):
+        """Add `count` new users to the room, with their conversations."""
+        start = CustomUser.objects.count()
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f"member{start + i}", email=f"member{start + i}@example.com")
+            for i in range(count)
+        ])
+        room.users.add(*users)
+        add_conversations(room, users)
+        return users
+
+    def report(self, title, columns, rows):
+        lines = [f"\n{title}", "  ".join(f"{column:>14}" for column in columns)]
+        lines += ["  ".join(f"{value:>14.2f}" if isinstance(value, float) else f"{value:>14}"
+                            for value in row) for row in rows]
+        print("\n".join(lines))
+
+
+class ConsumerThroughputBenchmark(BenchmarkMixin, ChatConsumerTestCase):
+    MESSAGES = 100
+
+    async def messages_per_second(self, room):
+        sender = await self.connect(self.alice, room)
+        await self.receive_all(sender)
+
+        started = time.perf_counter()
+        for i in range(self.MESSAGES):
+            await self.send_message(sender, f"bench {i}")
+            # Ack, then the room echo
+            await sender.receive_json_from()
+            await sender.receive_json_from()
+        elapsed = time.perf_counter() - started
+
+        await self.disconnect(sender)
+        return self.MESSAGES / elapsed
+
+    async def test_send_throughput_by_room_size(self):
+        rows = []
+        for size in (2, 50, 200):
+            room = await ChatRoom.objects.acreate(name=f"bench{size}")
+            await room.users.aadd(self.alice)
+            await database_sync_to_async(add_conversations)(room, [self.alice])
+            await database_sync_to_async(self.add_members)(room, size - 1)
+            rows.append((size, await self.messages_per_second(room)))
+
+        self.report("ChatConsumer sends", ["members", "messages/s"], rows)
+
+
+class MessageRenderBenchmark(BenchmarkMixin, HotViewTestCase):
+    RENDERS = 50
+
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="render")
+        GroupChat.objects.create(room=self.room, name="Render", admin=self.alice)
+        self.room.users.add(self.alice)
+        for i in range(20):
+            create_message(room=self.room, user=self.alice, content=f"message {i} " * 20)
+
+    def time_render(self, clear):
+        started = time.perf_counter()
+        for _ in range(self.RENDERS):
+            if clear:
+                cache.clear()
+            self.client.get(f"/chat/{self.room.name}/")
+        return (time.perf_counter() - started) / self.RENDERS * 1000
+
+    def test_room_render_cold_and_warm(self):
+        with override_settings(CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            uncached = self.time_render(clear=False)
+        cold = self.time_render(clear=True)
+        self.time_render(clear=False)
+        warm = self.time_render(clear=False)
+
+        self.report("Room page with 20 bubbles", ["cache", "ms/page"], [
+            ("none", uncached), ("cold", cold), ("warm", warm)])
+        self.assertLess(warm, uncached)
+
+
+
+class MessageWriteBenchmark(BenchmarkMixin, HotViewTestCase):
+    MESSAGES = 50
+
+    def ms_per_message(self, room):
+        started = time.perf_counter()
+        for i in range(self.MESSAGES):
+            with self.captureOnCommitCallbacks(execute=True):
+                create_message(room=room, user=self.alice, content=f"bench {i}")
+        return (time.perf_counter() - started) / self.MESSAGES * 1000
+
+    def test_write_cost_by_group_size(self):
+        rows = []
+        for size in (2, 50, 200, 1000):
+            room = ChatRoom.objects.create(name=f"write{size}")
+            room.users.add(self.alice)
+            add_conversations(room, [self.alice])
+            self.add_members(room, size - 1)
+            ms = self.ms_per_message(room)
+            rows.append((size, ms, ms / size * 1000))
+
+        self.report("create_message by group size", ["members", "ms/message", "us/member"], rows)
+        # Unread counts are bumped for the whole room in one UPDATE, so the
+        # cost per member keeps falling as the room grows
+        self.assertLess(rows[-1][2], rows[0][2] / 10)
+
+
+class HistoryPageBenchmark(BenchmarkMixin, HotViewTestCase):
+    MESSAGES = 20000
+    FETCHES = 20
+
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="deep")
+        self.room.users.add(self.alice)
+        now = timezone.now()
+        self.ids = [message.id for message in Message.objects.bulk_create(
+            [Message(room=self.room, user=self.alice, content=str(i),
+                     timestamp=now - timedelta(seconds=self.MESSAGES - i))
+             for i in range(self.MESSAGES)],
+            batch_size=1000,
+        )]
+
+    def ms_per_page(self, before):
+        started = time.perf_counter()
+        for _ in range(self.FETCHES):
+            response = self.client.get(f"/chat/messages/{self.room.name}/", {"before": before})
+        self.assertEqual(len(response.json()["messages"]), 20)
+        return (time.perf_counter() - started) / self.FETCHES * 1000
+
+    def test_page_latency_by_depth(self):
+        rows = []
+        for depth in (20, 1000, 10000, 19000):
+            rows.append((depth, self.ms_per_page(self.ids[-depth])))
+
+        self.report("History page by depth", ["messages back", "ms/page"], rows)
+        # Keyset pages seek the index instead of skipping rows
+        self.assertLess(rows[-1][1], rows[0][1] * 2)
@@ -4,8 +4,12 @@ from . import views
 app_name = "chat"
 urlpatterns = [
     path("", views.index, name="index"),
+    path("conversations/", views.conversation_list, name="conversation_list"),
     path("upload/", views.upload_file, name="upload_file"),
     path("messages/<str:room_name>/", views.get_messages, name="get_messages"),
+    path("messages/<str:room_name>/sync/", views.sync_messages, name="sync_messages"),
+    path("export/<str:room_name>/", views.export_room, name="export_room"),
+    path("viewers/<str:room_name>/", views.room_viewers, name="room_viewers"),
     path("create-group/", views.create_group, name="create_group"),
     path("message/<int:message_id>/edit/", views.edit_message, name="edit_message"),
     path("message/<int:message_id>/delete/", views.delete_message, name="delete_message"),
@@ -1,10 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Case, DateTimeField, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
-from .models import ChatRoom, PrivateChat
+from accounts.models import CustomUser
+from .models import ChatRoom, Conversation, Message, PrivateChat
 from friends.models import FriendRequest
 import hashlib
 
+# INCR each key that exists, in one round trip. INCR keeps the key's TTL,
+# and a key that has expired stays missing (the next read rebuilds it)
+# instead of being recreated without one.
+INCR_EXISTING_LUA = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('INCR', key)
+    end
+end
+"""
+
+# Seconds a rendered message bubble stays cached; edits and deletes change
+# its key, so this only bounds how long unused entries linger
+MESSAGE_CONTENT_CACHE_TTL = 86400
+
 
 def serialize_user(user):
     return {
@@ -14,6 +36,73 @@ def serialize_user(user):
     }
 
 
+def serialize_chat_message(msg):
+    return {
+        "id": msg.id,
+        "client_id": str(msg.client_id) if msg.client_id else None,
+        "message": msg.content,
+        "sender": serialize_user(msg.user),
+        "timestamp": msg.timestamp.isoformat(),
+        "is_file": msg.is_file
+    }
+
+
+def message_content_key(msg):
+    edited = msg.edited_at.timestamp() if msg.edited_at else 0
+    return f"chat:message_content:{msg.id}:{edited}:{int(msg.is_delete)}"
+
+
+def render_message_contents(messages):
+    """
+    Set `content_html` on each message from the shared fragment cache.
+
+    The bubbles are the same for every viewer, so all of them are fetched
+    with one get_many; the misses are rendered and stored with one set_many.
+    """
+    keys = {message_content_key(msg): msg for msg in messages}
+    cached = cache.get_many(keys)
+    missing = {}
+    for key, msg in keys.items():
+        if key not in cached:
+            cached[key] = missing[key] = render_to_string(
+                "chat/partials/message_content.html", {"msg": msg})
+        msg.content_html = mark_safe(cached[key])
+    if missing:
+        cache.set_many(missing, MESSAGE_CONTENT_CACHE_TTL)
+    return messages
+
+
+async def get_viewer_list(viewers):
+    """
+    Serialize the users of a viewer registry lookup.
+
+    Args:
+        viewers: Counter of live connections per user id
+    """
+    users = CustomUser.objects.filter(id__in=list(viewers)).order_by("username")
+    return [
+        {**serialize_user(user), "connections": viewers[user.id]}
+        async for user in users
+    ]
+
+
+def co_member_ids(user):
+    """
+    Ids of everyone who shares at least one room with the user.
+
+    One DISTINCT query over the membership table, instead of loading
+    every member of every room; works with both list() and async for.
+    """
+    Membership = ChatRoom.users.through
+    return (
+        Membership.objects.filter(
+            chatroom_id__in=Membership.objects.filter(customuser_id=user.id).values("chatroom_id"))
+        .exclude(customuser_id=user.id)
+        .values_list("customuser_id", flat=True)
+        .distinct()
+    )
+
+
 def get_sorted_pair(u1, u2):
     return (u1, u2) if u1.id < u2.id else (u2, u1)
 
@@ -38,11 +127,121 @@ def get_or_create_private_room(user, friend):
             name=private_room_name(u_small, u_big), display_name=friend.full_name)
         # attach both users to the room.users M2M
         room.users.add(user, friend)
+        add_conversations(room, [user, friend])
         pc = PrivateChat.objects.create(
             user_a=u_small, user_b=u_big, room=room)
         return room, True
 
 
+def mark_room_read(user, room):
+    """Clear the user's unread count for the room."""
+    Conversation.objects.filter(user=user, room=room).update(unread_count=0)
+    cache.delete(unread_total_key(user.id))
+
+
+async def amark_room_read(user, room):
+    """Async version of mark_room_read for the consumers."""
+    await Conversation.objects.filter(user=user, room=room).aupdate(unread_count=0)
+    await cache.adelete(unread_total_key(user.id))
+
+
+def unread_total_key(user_id):
+    return f"chat:unread_total:{user_id}"
+
+
+def get_unread_total(user):
+    """
+    Total unread messages across the user's rooms.
+
+    Served from the cache, which record_message increments and
+    mark_room_read drops. A miss, or an entry past CHAT_UNREAD_CACHE_TTL,
+    is rebuilt from the conversations, so a counter that drifted (an
+    increment lost to a racing rebuild) is repaired within the TTL.
+    """
+    key = unread_total_key(user.id)
+    total = cache.get(key)
+    if total is None:
+        total = user.conversations.aggregate(total=Sum("unread_count"))["total"] or 0
+        cache.add(key, total, settings.CHAT_UNREAD_CACHE_TTL)
+    return total
+
+
+def _increment_unread_totals(user_ids):
+    keys = [unread_total_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        # One script call for the whole room instead of EXISTS + INCR per member
+        client = backend._cache.get_client(write=True)
+        client.eval(
+            INCR_EXISTING_LUA, len(keys), *(backend.make_and_validate_key(key) for key in keys))
+        return
+
+    # In-process caches have no round trips to save
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not cached; the next read rebuilds it
+            pass
+
+
+def add_conversations(room, users):
+    """Give newly added room members their sidebar entry for the room."""
+    Conversation.objects.bulk_create(
+        [
+            Conversation(
+                user=user,
+                room=room,
+                last_activity_at=room.last_activity_at or room.created_at,
+            )
+            for user in users
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_conversations(room, users):
+    Conversation.objects.filter(room=room, user__in=users).delete()
+    # Their unread messages in the room no longer count
+    cache.delete_many([unread_total_key(user.id) for user in users])
+
+
+def record_message(message):
+    """Point the room and every member's conversation at a new message."""
+    # Concurrent sends can commit out of order; never move backwards
+    ChatRoom.objects.filter(pk=message.room_id).filter(
+        Q(last_activity_at__isnull=True) | Q(last_activity_at__lte=message.timestamp)
+    ).update(last_message=message, last_activity_at=message.timestamp)
+
+    Conversation.objects.filter(room_id=message.room_id).update(
+        last_activity_at=Greatest(
+            "last_activity_at", Value(message.timestamp, output_field=DateTimeField())),
+        # The sender's own messages never count as unread
+        unread_count=Case(
+            When(user_id=message.user_id, then=F("unread_count")),
+            default=F("unread_count") + 1,
+        ),
+    )
+
+    recipient_ids = list(
+        Conversation.objects.filter(room_id=message.room_id)
+        .exclude(user_id=message.user_id)
+        .values_list("user_id", flat=True)
+    )
+    transaction.on_commit(lambda: _increment_unread_totals(recipient_ids))
+
+
+@transaction.atomic
+def create_message(**fields):
+    """Store a message and record it on its room in one transaction."""
+    message = Message.objects.create(**fields)
+    record_message(message)
+    return message
+
+
 def are_friends(user1, user2):
     return FriendRequest.objects.filter(
         (Q(from_user=user1, to_user=user2) | Q(from_user=user2, to_user=user1)),
@@ -1,31 +1,58 @@
 from django.shortcuts import redirect, render
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
 from django.db import transaction
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 
+from asgiref.sync import async_to_sync
 from datetime import timedelta
+import hashlib
 
 from django.utils.autoreload import is_django_module
 
 from accounts.models import CustomUser
-from .models import ChatRoom, Message, MessageReadStatus, GroupChat
+from .models import ChatRoom, Message, GroupChat
 from .forms import MessageFileForm
-from .utils import group_room_name
+from .connections import viewer_registry
+from .export import CONTENT_TYPES, aexport_lines, aexport_messages, export_row, parse_export_bound
+from .utils import (
+    add_conversations,
+    group_room_name,
+    mark_room_read,
+    remove_conversations,
+    render_message_contents,
+    serialize_chat_message,
+    serialize_user,
+)
+from .sidebar import SidebarContext, get_conversations, get_room_entries
+from notifications.utils import update_user_online_status
 from .broadcast_utils import (
     broadcast_message_edited,
     broadcast_message_deleted,
     broadcast_message_update,
     broadcast_system_message,
     broadcast_group_update,
+    broadcast_to_room_users,
     broadcast_to_user,
 )
 
+# Messages per page of room history
+MESSAGE_PAGE_SIZE = 20
+# Changes one sync may return; a client further behind reloads the room
+MESSAGE_SYNC_LIMIT = 200
+# Rows written by transactions still open when the previous sync ran can
+# carry an updated_at just before its cursor, so every sync looks back a bit
+MESSAGE_SYNC_OVERLAP = timedelta(seconds=5)
+
 
 def landing_view(request):
     if request.user.is_authenticated:
@@ -33,113 +60,55 @@ def landing_view(request):
     return render(request, "chat/landing.html")
 
 
-def get_rooms_context(user):
-    rooms = user.chat_rooms.all()
-    room_data = []
-
-    for room in rooms:
-        last_message = room.messages.last()
-        unread_count = MessageReadStatus.objects.filter(
-            user=user,
-            message__room=room,
-            is_read=False
-        ).count()
-
-        # Logic for dynamic display name
-        display_name = room.display_name
-        is_online = False
-        other_user_id = None
-        avatar_url = None
-        is_group = False
-
-        if hasattr(room, 'group_chat'):
-            display_name = room.group_chat.name
-            is_group = True
-            if room.group_chat.icon:
-                avatar_url = room.group_chat.icon.url
-        elif hasattr(room, 'private_chat'):
-            private_chat = room.private_chat
-            other_user = private_chat.user_a if private_chat.user_b == user else private_chat.user_b
-            display_name = other_user.full_name if other_user.full_name else other_user.username
-            is_online = other_user.is_online
-            other_user_id = other_user.id
-            avatar_url = other_user.avatar.url if other_user.avatar else None
-
-        room_data.append(
-            {
-                'room': room,
-                'display_name': display_name,
-                'is_online': is_online,
-                'other_user_id': other_user_id,
-                'last_message': last_message,
-                'unread_count': unread_count,
-                # Fallback to room creation
-                'last_message_timestamp': last_message.timestamp if last_message else room.created_at,
-                'avatar_url': avatar_url,
-                'is_group': is_group,
-                'group_chat': getattr(room, 'group_chat', None)
-            }
-        )
-
-    # Sort by last message timestamp descending
-    room_data.sort(key=lambda x: x['last_message_timestamp'], reverse=True)
-
-    # Get pending friend request count
-    from friends.models import FriendRequest
-    pending_requests_count = FriendRequest.objects.filter(
-        to_user=user,
-        is_accepted=False
-    ).count()
-
-    # Get friends list for group creation
-    friends = []
-    accepted_requests = FriendRequest.objects.filter(
-        (Q(from_user=user) | Q(to_user=user)) & Q(is_accepted=True)
-    ).select_related('from_user', 'to_user')
-
-    for req in accepted_requests:
-        if req.from_user == user:
-            friends.append(req.to_user)
-        else:
-            friends.append(req.from_user)
-
-    return {
-        'rooms': room_data,
-        # TODO: we could probably use a context_processor for this
-        # as this is something that is shared among all pages
-        'pending_requests_count': pending_requests_count,
-        'friends': friends
-    }
+@login_required
+def index(request):
+    # The sidebar is filled in lazily by the sidebar context processor
+    return render(request, "chat/index.html")
 
 
 @login_required
-def index(request):
-    user = request.user
-    context = get_rooms_context(user)
-    return render(request, "chat/index.html", context)
+def conversation_list(request):
+    """Render the next page of sidebar conversations after the `before` cursor."""
+    try:
+        before = (parse_datetime(request.GET['before']), int(request.GET['before_id']))
+    except (KeyError, ValueError, TypeError):
+        return JsonResponse({'error': 'before and before_id are required'}, status=400)
+    if before[0] is None:
+        return JsonResponse({'error': 'Invalid before timestamp'}, status=400)
+
+    page_size = settings.CHAT_SIDEBAR_PAGE_SIZE
+    conversations = list(get_conversations(request.user, before)[:page_size + 1])
+    html = render_to_string("chat/partials/sidebar_room_items.html", {
+        'rooms': get_room_entries(request.user, conversations[:page_size]),
+        'room_name': request.GET.get('room'),
+        'request': request,
+    })
+    return JsonResponse({'html': html, 'has_more': len(conversations) > page_size})
 
 
 @login_required
 def room(request, room_name):
     try:
-        room = ChatRoom.objects.get(name=room_name)
+        room = ChatRoom.objects.select_related(
+            'group_chat__admin', 'private_chat__user_a', 'private_chat__user_b'
+        ).get(name=room_name)
     except ChatRoom.DoesNotExist:
         messages.error(request, "Chat room does not exist.")
         return redirect("chat:index")
 
     # permission check
-    if request.user not in room.users.all():
+    members = list(room.users.all())
+    if request.user not in members:
         messages.error(request, "You are not allowed to join the chat.")
         return redirect("chat:index")
 
+    # Taken before the query so nothing written meanwhile is skipped by the
+    # first sync after a reconnect
+    sync_cursor = timezone.now()
     messages_qs = Message.objects.filter(room=room).select_related(
-        "user").order_by('-timestamp')[:20]
+        "user").order_by('-timestamp', '-id')[:MESSAGE_PAGE_SIZE]
     # Reverse to show oldest first in the template
-    messages_qs = reversed(messages_qs)
-
-    # Get sidebar data
-    # TODO: okay this is not used
-    room_data = get_rooms_context(request.user)
+    messages_qs = render_message_contents(list(reversed(messages_qs)))
 
     # Calculate display name for the current room
     display_name = room.display_name
@@ -164,33 +133,20 @@ def room(request, room_name):
                 Q(from_user=other_user, to_user=request.user, is_accepted=True)
             ).exists()
 
-    # Get other context data
-    other_context = get_rooms_context(request.user)
-
     # Get room members for group chat
     room_members = []
     friends_not_in_group = []
     group_chat = None
     if is_group:
-        room_members = room.users.all()
+        room_members = members
         group_chat = room.group_chat
         
         # Get user's friends who are not in the group
-        from friends.models import FriendRequest
-        
-        # Get all accepted friend requests
-        friend_requests = FriendRequest.objects.filter(
-            Q(from_user=request.user, is_accepted=True) |
-            Q(to_user=request.user, is_accepted=True)
-        )
-        
-        friends = set()
-        for fr in friend_requests:
-            friend = fr.to_user if fr.from_user == request.user else fr.from_user
-            if friend not in room.users.all():
-                friends.add(friend)
-        
-        friends_not_in_group = list(friends)
+        member_ids = {member.id for member in room_members}
+        friends_not_in_group = [
+            friend for friend in SidebarContext.for_request(request).friends()
+            if friend.id not in member_ids
+        ]
 
     context = {
         "room_name": room_name,
@@ -203,8 +159,8 @@ def room(request, room_name):
         "room_id": room.room_id,
         "room_members": room_members,
         "friends_not_in_group": friends_not_in_group,
+        "sync_cursor": sync_cursor.isoformat(),
     }
-    context.update(other_context)
     return render(request, "chat/room.html", context)
 
 
@@ -254,6 +210,12 @@ def upload_file(request):
 
 @login_required
 def get_messages(request, room_name):
+    """
+    A page of the room's history, newest first.
+
+    `before` / `after` take a message id and return the page just older /
+    newer than that message; without either the newest page is returned.
+    """
     try:
         room = ChatRoom.objects.get(name=room_name)
     except ChatRoom.DoesNotExist:
@@ -262,11 +224,38 @@ def get_messages(request, room_name):
     if request.user not in room.users.all():
         return JsonResponse({'error': 'Not allowed'}, status=403)
 
-    offset = int(request.GET.get('offset', 0))
-    limit = 20
+    # Keyset pagination on (timestamp, id): pages stay put while new
+    # messages arrive and deep pages cost the same as the first one
+    messages = Message.objects.filter(room=room).select_related('user')
+    cursor_param = 'before' if 'before' in request.GET else 'after' if 'after' in request.GET else None
+    if cursor_param:
+        try:
+            cursor = Message.objects.only('timestamp').get(
+                room=room, id=int(request.GET[cursor_param]))
+        except (ValueError, Message.DoesNotExist):
+            return JsonResponse({'error': f'Invalid {cursor_param} cursor'}, status=400)
+
+    # The plain range on timestamp lets the index seek to the cursor; the
+    # OR alone only filters while walking down from the newest message
+    if cursor_param == 'after':
+        messages = messages.filter(
+            Q(timestamp__gt=cursor.timestamp) | Q(timestamp=cursor.timestamp, id__gt=cursor.id),
+            timestamp__gte=cursor.timestamp,
+        ).order_by('timestamp', 'id')
+    else:
+        if cursor_param == 'before':
+            messages = messages.filter(
+                Q(timestamp__lt=cursor.timestamp) | Q(timestamp=cursor.timestamp, id__lt=cursor.id),
+                timestamp__lte=cursor.timestamp,
+            )
+        messages = messages.order_by('-timestamp', '-id')
 
-    messages = Message.objects.filter(room=room).select_related(
-        'user').order_by('-timestamp')[offset:offset+limit]
+    # One extra row tells whether there is another page
+    messages = list(messages[:MESSAGE_PAGE_SIZE + 1])
+    has_more = len(messages) > MESSAGE_PAGE_SIZE
+    messages = messages[:MESSAGE_PAGE_SIZE]
+    if cursor_param == 'after':
+        messages.reverse()
 
     data = []
     for msg in messages:
@@ -280,7 +269,138 @@ def get_messages(request, room_name):
             'is_me': msg.user == request.user
         })
 
-    return JsonResponse({'messages': data})
+    # Newest first, whichever direction was paged
+    return JsonResponse({'messages': data, 'has_more': has_more})
+
+
+def _sync_etag(request, room_name):
+    """
+    Version of the delta for the requested `since`, for members only.
+
+    The response is fully determined by `since` and the room's latest
+    change, so both go into the tag.
+    """
+    latest = Message.objects.filter(
+        room__name=room_name, room__users=request.user
+    ).aggregate(latest=Max('updated_at'))['latest']
+    if latest is None:
+        return None
+    version = f"{request.GET.get('since', '')}|{latest.isoformat()}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+@login_required
+@condition(etag_func=_sync_etag)
+def sync_messages(request, room_name):
+    """
+    Messages created, edited or deleted since `since`, for a client
+    catching up after a reconnect.
+
+    `since` is the `cursor` of the previous sync (or of the room page), or
+    a message id to catch up from when that message was sent. Clients send
+    the ETag they last saw as If-None-Match, so an unchanged room is a 304.
+    """
+    try:
+        room = ChatRoom.objects.get(name=room_name)
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Room not found'}, status=404)
+
+    if request.user not in room.users.all():
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    since = request.GET.get('since', '')
+    try:
+        if since.isdigit():
+            since = Message.objects.get(room=room, id=int(since)).timestamp
+        else:
+            since = parse_datetime(since)
+    except (ValueError, Message.DoesNotExist):
+        since = None
+    if since is None:
+        return JsonResponse({'error': 'Invalid since cursor'}, status=400)
+
+    changes = list(
+        Message.objects.filter(room=room, updated_at__gte=since - MESSAGE_SYNC_OVERLAP)
+        .select_related('user')
+        .order_by('updated_at', 'id')[:MESSAGE_SYNC_LIMIT + 1]
+    )
+    has_more = len(changes) > MESSAGE_SYNC_LIMIT
+    changes = changes[:MESSAGE_SYNC_LIMIT]
+    # Resume from the newest change seen rather than the clock, so the
+    # response (and its ETag) only depends on `since` and the room
+    cursor = max([since] + [msg.updated_at for msg in changes])
+    changes.sort(key=lambda msg: (msg.timestamp, msg.id))
+
+    return JsonResponse({
+        # Oldest first, in the shape the room socket delivers them
+        'messages': [
+            {**serialize_chat_message(msg), 'edited': msg.edited_at is not None}
+            for msg in changes if not msg.is_delete
+        ],
+        'deleted': [msg.id for msg in changes if msg.is_delete],
+        'cursor': cursor.isoformat(),
+        'has_more': has_more,
+    })
+
+
+@login_required
+def export_room(request, room_name):
+    """
+    Stream the room's whole history as NDJSON (default) or CSV.
+
+    `start` and `end` (ISO dates or datetimes, end exclusive) narrow it
+    to a date range.
+    """
+    try:
+        room = ChatRoom.objects.get(name=room_name)
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Room not found'}, status=404)
+
+    if request.user not in room.users.all():
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in CONTENT_TYPES:
+        return JsonResponse({'error': 'Format must be ndjson or csv'}, status=400)
+    try:
+        start, end = (
+            parse_export_bound(request.GET[bound]) if request.GET.get(bound) else None
+            for bound in ('start', 'end')
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Async iterators are streamed as they are under ASGI; sync ones would
+    # be read into memory first
+    rows = (
+        export_row(msg, request.build_absolute_uri)
+        async for msg in aexport_messages(room, start, end)
+    )
+    response = StreamingHttpResponse(
+        aexport_lines(rows, export_format), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{room.room_id}.{export_format}"'
+    return response
+
+
+@login_required
+def room_viewers(request, room_name):
+    """Users currently viewing the room, with their number of open connections"""
+    try:
+        room = ChatRoom.objects.get(name=room_name)
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Room not found'}, status=404)
+
+    if request.user not in room.users.all():
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    viewers = async_to_sync(viewer_registry.members)(room.name)
+    users = CustomUser.objects.filter(id__in=list(viewers)).order_by('username')
+
+    data = []
+    for user in users:
+        data.append({**serialize_user(user), 'connections': viewers[user.id]})
+
+    return JsonResponse({'viewers': data})
 
 
 @login_required
@@ -317,17 +437,17 @@ def create_group(request):
                 User = get_user_model()
                 users_to_add = User.objects.filter(id__in=user_ids)
                 room.users.add(*users_to_add)
+                add_conversations(room, [request.user, *users_to_add])
 
                 # Broadcast group creation to all members
-                for user in room.users.all():
-                    broadcast_to_user(
-                        user.id,
-                        "group_created",
-                        {
-                            "room_id": str(room.room_id),
-                            "room_name": group_name,
-                        }
-                    )
+                broadcast_to_room_users(
+                    room,
+                    "group_created",
+                    {
+                        "room_id": str(room.room_id),
+                        "room_name": group_name,
+                    }
+                )
 
                 messages.success(request, f"Group '{group_name}' created!")
                 return redirect('chat:room', room_name=room.name)
@@ -448,6 +568,7 @@ def leave_group(request, room_id):
         # Remove user
         if request.user in room.users.all():
             room.users.remove(request.user)
+            remove_conversations(room, [request.user])
 
             new_admin_id = None
             # If user was admin, assign new admin or delete group if empty
@@ -511,6 +632,7 @@ def kick_member(request, room_id, user_id):
 
         if target_user in room.users.all():
             room.users.remove(target_user)
+            remove_conversations(room, [target_user])
 
             # Notify room
             broadcast_system_message(
@@ -612,16 +734,16 @@ def delete_group(request, room_id):
             return JsonResponse({'error': 'Only admin can delete group'}, status=403)
 
         # Notify all members before deletion
-        for user in room.users.all():
-            broadcast_to_user(
-                user.id,
-                "group_deleted",
-                {
-                    "room_id": str(room.room_id),
-                    "room_name": group.name
-                }
-            )
+        broadcast_to_room_users(
+            room,
+            "group_deleted",
+            {
+                "room_id": str(room.room_id),
+                "room_name": group.name
+            }
+        )
 
+        remove_conversations(room, list(room.users.all()))
         room.delete()
         return JsonResponse({'status': 'ok'})
 
@@ -641,33 +763,7 @@ def update_status(request):
             # Fallback for FormData from sendBeacon
             is_online = request.POST.get('is_online', 'true') == 'true'
 
-        request.user.is_online = is_online
-        request.user.save(update_fields=['is_online'])
-
-        # Broadcast status change
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        channel_layer = get_channel_layer()
-
-        # Get all rooms this user is part of
-        rooms = request.user.chat_rooms.prefetch_related('users').all()
-        notified_users = set()
-
-        for room in rooms:
-            for other_user in room.users.all():
-                if other_user != request.user and other_user.id not in notified_users:
-                    async_to_sync(channel_layer.group_send)(
-                        f"notification_{other_user.id}",
-                        {
-                            "type": "notify",
-                            "data": {
-                                "event": "status_change",
-                                "user_id": request.user.id,
-                                "is_online": is_online
-                            }
-                        }
-                    )
-                    notified_users.add(other_user.id)
+        async_to_sync(update_user_online_status)(request.user, is_online)
 
         return JsonResponse({'status': 'ok'})
 
@@ -704,6 +800,9 @@ def add_member(request, room_id, user_id):
         
         # Add user
         room.users.add(target_user)
+        add_conversations(room, [target_user])
+        # Earlier history shouldn't show up as unread for the new member
+        mark_room_read(target_user, room)
         
         # Broadcast to room
         broadcast_system_message(
@@ -70,6 +70,7 @@ TEMPLATES = [
 
                 "chat.context_processors.unread_count",
                 "chat.context_processors.friend_requests_count",
+                "chat.context_processors.sidebar",
                 "chat.context_processors.version",
                 "chat.context_processors.user_context",
             ],
@@ -148,6 +149,35 @@ else:
         }
     }
 
+# ==============================================================================
+# CHAT
+# ==============================================================================
+
+# Minimum seconds between repeated "is typing" broadcasts for one user
+CHAT_TYPING_THROTTLE = float(os.environ.get("CHAT_TYPING_THROTTLE", 3))
+# Seconds without a typing report before the indicator is cleared
+CHAT_TYPING_TIMEOUT = float(os.environ.get("CHAT_TYPING_TIMEOUT", 5))
+# Seconds a user_leave is held back so a quick reconnect can cancel it
+CHAT_LEAVE_GRACE_PERIOD = float(os.environ.get("CHAT_LEAVE_GRACE_PERIOD", 2))
+# Seconds a live connection stays registered without a heartbeat
+CHAT_CONNECTION_TTL = float(os.environ.get("CHAT_CONNECTION_TTL", 60))
+# Conversations shown in the sidebar before more are loaded on scroll
+CHAT_SIDEBAR_PAGE_SIZE = int(os.environ.get("CHAT_SIDEBAR_PAGE_SIZE", 50))
+# Seconds an online/offline change is held back so an opposite one (a page
+# refresh, a network handoff) can cancel it
+CHAT_PRESENCE_GRACE_PERIOD = float(os.environ.get("CHAT_PRESENCE_GRACE_PERIOD", 5))
+# Seconds a notification socket collects status changes into one status_batch
+CHAT_PRESENCE_BATCH_INTERVAL = float(os.environ.get("CHAT_PRESENCE_BATCH_INTERVAL", 1))
+# Most users one notification socket can follow the presence of
+CHAT_PRESENCE_MAX_SUBSCRIPTIONS = int(os.environ.get("CHAT_PRESENCE_MAX_SUBSCRIPTIONS", 500))
+# Seconds socket activity is buffered before last_seen is written in bulk;
+# also the most activity a crashed worker can lose
+CHAT_LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get("CHAT_LAST_SEEN_FLUSH_INTERVAL", 30))
+# Buffered users that trigger a flush before the interval is up
+CHAT_LAST_SEEN_MAX_PENDING = int(os.environ.get("CHAT_LAST_SEEN_MAX_PENDING", 1000))
+# Seconds a cached unread total is trusted before it is rebuilt from the DB
+CHAT_UNREAD_CACHE_TTL = int(os.environ.get("CHAT_UNREAD_CACHE_TTL", 300))
+
 # ==============================================================================
 # SECURITY SETTINGS (PRODUCTION)
 # ==============================================================================
@@ -25,6 +25,12 @@ class FriendRequest(models.Model):
             models.UniqueConstraint(
                 fields=["from_user", "to_user"], name="unique_friend_requests")
         ]
+        indexes = [
+            # Requests seen from the receiving side, accepted (friends) or
+            # pending (the badge on every page); the from_user side is
+            # covered by unique_friend_requests
+            models.Index(fields=["to_user", "is_accepted"], name="friendrequest_to_user_idx"),
+        ]
 
     def __str__(self):
         status = "Accepted" if self.is_accepted else "Pending"
@@ -1,12 +1,28 @@
-import json
+import asyncio
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .utils import update_user_online_status
+from django.conf import settings
+
+from accounts.models import CustomUser
+from chat.connections import presence_registry
+from chat.frames import FrameCodecMixin
+from chat.utils import co_member_ids
+from .last_seen import last_seen_buffer
+from .presence import presence_aggregator, presence_sweeper
+from .utils import presence_group
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(FrameCodecMixin, AsyncWebsocketConsumer):
+    heartbeat = None
+
     async def connect(self):
         self.user = self.scope['user']
         self.group_name = f"notification_{self.user.id}"
+        # Users whose presence this connection follows, and the changes
+        # waiting for the next status_batch
+        self.presence_subscriptions = set()
+        self.presence_changes = {}
+        self.presence_flush = None
 
         if not self.user.is_authenticated:
             await self.close()
@@ -17,22 +33,105 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_frames()
+
+        connections = await presence_registry.add(
+            self.user.id, self.user.id, self.channel_name)
+        self.heartbeat = asyncio.create_task(presence_registry.keep_alive(
+            self.user.id, self.user.id, self.channel_name))
+        presence_sweeper.start()
+        last_seen_buffer.touch(self.user.id)
+        last_seen_buffer.start()
 
-        # Update online status
-        await update_user_online_status(self.user, True)
+        # Other tabs already keep the user online
+        if connections[self.user.id] == 1:
+            presence_aggregator.report(self.user, True)
 
     async def disconnect(self, close_code):
-        # Update online status
-        if self.user.is_authenticated:
-            await update_user_online_status(self.user, False)
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            last_seen_buffer.touch(self.user.id)
+            connections = await presence_registry.remove(
+                self.user.id, self.user.id, self.channel_name)
+
+            # Offline only once the user's last connection is gone
+            if not connections[self.user.id]:
+                presence_aggregator.report(self.user, False)
+
+        if self.presence_flush is not None:
+            self.presence_flush.cancel()
+        for user_id in self.presence_subscriptions:
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
 
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
 
+    async def receive(self, text_data=None, bytes_data=None):
+        frame = self.decode_frame(text_data, bytes_data)
+        last_seen_buffer.touch(self.user.id)
+        match frame["type"]:
+            case "presence_subscribe":
+                await self.subscribe_presence(frame["data"]["user_ids"])
+
+    async def subscribe_presence(self, user_ids):
+        """
+        Follow the presence of exactly these users from now on.
+
+        The client sends the users whose status it currently shows. Only
+        users who share a room with this user can be followed. Newly
+        followed users get their current status right away.
+        """
+        requested = [
+            user_id for user_id in user_ids if isinstance(user_id, int)
+        ][:settings.CHAT_PRESENCE_MAX_SUBSCRIPTIONS]
+        allowed = {
+            user_id async for user_id in
+            co_member_ids(self.user).filter(customuser_id__in=requested)
+        }
+
+        for user_id in self.presence_subscriptions - allowed:
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
+        added = allowed - self.presence_subscriptions
+        for user_id in added:
+            await self.channel_layer.group_add(presence_group(user_id), self.channel_name)
+        self.presence_subscriptions = allowed
+
+        # Read only once the groups are joined: a change published in
+        # between then arrives as a presence_change instead of being lost
+        if added:
+            self.presence_changes.update(await self.read_presence(added))
+        await self.send_presence_changes()
+
+    async def read_presence(self, user_ids):
+        """Current is_online flag of each of the users."""
+        return {
+            user_id: is_online
+            async for user_id, is_online in CustomUser.objects.filter(
+                id__in=user_ids).values_list("id", "is_online")
+        }
+
+    async def presence_change(self, event):
+        """A followed user's status changed; send it with the next batch."""
+        self.presence_changes[event["user_id"]] = event["is_online"]
+        if self.presence_flush is None or self.presence_flush.done():
+            self.presence_flush = asyncio.create_task(self.send_presence_changes_later())
+
+    async def send_presence_changes_later(self):
+        await asyncio.sleep(settings.CHAT_PRESENCE_BATCH_INTERVAL)
+        await self.send_presence_changes()
+
+    async def send_presence_changes(self):
+        changes, self.presence_changes = self.presence_changes, {}
+        if changes:
+            await self.send_frame({
+                "event": "status_batch",
+                "statuses": [
+                    {"user_id": user_id, "is_online": is_online}
+                    for user_id, is_online in changes.items()
+                ],
+            })
+
     async def notify(self, event):
-        await self.send(
-            text_data=json.dumps(event["data"])
-        )
+        await self.send_frame(event["data"])
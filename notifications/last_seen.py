@@ -0,0 +1,118 @@
+"""
+Write-behind tracking of CustomUser.last_seen.
+
+Socket consumers call last_seen_buffer.touch() on every event. That only
+records the time in memory; the buffer is written to the database in
+bulk, one UPDATE per LAST_SEEN_BATCH_SIZE users, every
+CHAT_LAST_SEEN_FLUSH_INTERVAL seconds, as soon as
+CHAT_LAST_SEEN_MAX_PENDING users are waiting, and when the process exits.
+Database writes therefore grow with the number of active users, not with
+how chatty their clients are.
+
+Loss is bounded: a worker that dies without running its exit hook loses
+at most one interval of activity, and a failed flush keeps its entries
+for the next attempt.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from accounts.models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+LAST_SEEN_BATCH_SIZE = 500
+
+
+class LastSeenBuffer:
+    """
+    Collects the latest activity time per user and writes it in bulk.
+
+    touch() runs on the event loop while flush() runs in a worker thread,
+    so the pending entries are guarded by a lock.
+    """
+
+    def __init__(self, interval, max_pending):
+        self.interval = interval
+        self.max_pending = max_pending
+        # user id -> time of the user's latest activity
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def touch(self, user_id):
+        """Record activity of the user now; flushes early once the buffer is full."""
+        with self._lock:
+            self._pending[user_id] = timezone.now()
+            full = len(self._pending) >= self.max_pending
+        if not full:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+        else:
+            loop.create_task(self.aflush())
+
+    def flush(self):
+        """
+        Write all buffered activity.
+
+        Returns:
+            Number of users written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        entries = list(pending.items())
+        try:
+            for start in range(0, len(entries), LAST_SEEN_BATCH_SIZE):
+                batch = entries[start:start + LAST_SEEN_BATCH_SIZE]
+                CustomUser.objects.filter(id__in=[user_id for user_id, _ in batch]).update(
+                    last_seen=Case(
+                        *[When(id=user_id, then=Value(seen)) for user_id, seen in batch],
+                        output_field=DateTimeField(),
+                    )
+                )
+        except Exception:
+            # Keep the entries for the next flush; newer activity wins
+            with self._lock:
+                for user_id, seen in entries:
+                    self._pending.setdefault(user_id, seen)
+            raise
+        return len(entries)
+
+    async def aflush(self):
+        try:
+            return await database_sync_to_async(self.flush)()
+        except Exception:
+            logger.exception("Flushing last_seen failed")
+            return 0
+
+    def start(self):
+        """Start flushing on the running event loop, unless already running there."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.aflush()
+
+
+last_seen_buffer = LastSeenBuffer(
+    settings.CHAT_LAST_SEEN_FLUSH_INTERVAL, settings.CHAT_LAST_SEEN_MAX_PENDING)
+
+# Write what is still buffered when the worker shuts down cleanly
+atexit.register(last_seen_buffer.flush)
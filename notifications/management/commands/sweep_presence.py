@@ -0,0 +1,28 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.connections import MemoryConnectionRegistry, presence_registry
+from notifications.presence import sweep_presence
+
+
+class Command(BaseCommand):
+    help = "Take users offline whose notification connections have all expired."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Sweep even though the connection registry is not shared (no REDIS_URL).",
+        )
+
+    def handle(self, *args, **options):
+        # Without Redis this process sees none of the workers' connections
+        # and would take every online user offline
+        if isinstance(presence_registry, MemoryConnectionRegistry) and not options["force"]:
+            raise CommandError(
+                "The presence registry is in process memory (REDIS_URL is not set), "
+                "so no live connections are visible from here. Use --force to "
+                "take every online user offline anyway."
+            )
+
+        swept = async_to_sync(sweep_presence)()
+        self.stdout.write(self.style.SUCCESS(f"Took {len(swept)} users offline."))
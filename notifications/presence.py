@@ -0,0 +1,170 @@
+"""
+Online status derived from live notification sockets.
+
+Every NotificationConsumer registers in presence_registry and keeps its
+entry fresh with heartbeats. A user goes online when their first
+connection registers and offline when their last one goes away, so
+closing one of several tabs changes nothing. Entries of a crashed worker
+are no longer refreshed and expire after CHAT_CONNECTION_TTL;
+sweep_presence then takes those users offline.
+
+Changes go through PresenceAggregator, which cancels flaps (a refresh is
+an offline immediately followed by an online) and publishes what is left
+to the user's presence group. Only connections that subscribed to the
+user (because the client shows their status) are in that group, and
+each of them batches what it receives into status_batch frames.
+"""
+
+import asyncio
+import logging
+
+from django.conf import settings
+
+from accounts.models import CustomUser
+from chat.connections import presence_registry
+from .utils import publish_presence, set_online_flag
+
+logger = logging.getLogger(__name__)
+
+# Online users checked per registry round trip in sweep_presence
+SWEEP_BATCH_SIZE = 500
+
+
+class PresenceAggregator:
+    """
+    Debounces online/offline changes.
+
+    report() holds a change for `grace_period` seconds, and an opposite
+    report for the same user within that window cancels both, leaving only a
+    check that the stored flag matches the user's connections. Changes that
+    survive are checked against presence_registry (the user may have come
+    back through another worker), written, and published.
+    """
+
+    def __init__(self, grace_period):
+        self.grace_period = grace_period
+        # user id -> (is_online, task applying it after the grace period)
+        self._pending = {}
+        # Re-checks started by cancelled flaps
+        self._reconciling = set()
+
+    def report(self, user, is_online):
+        """Schedule a change of the user's status, or cancel the opposite one."""
+        pending = self._pending.get(user.id)
+        if pending is not None:
+            pending_is_online, task = pending
+            if pending_is_online == is_online:
+                return
+            # Flap: the two changes cancel out. The stored flag may still be
+            # stale (a sweep ran in between), so bring it in line with the
+            # user's connections.
+            task.cancel()
+            del self._pending[user.id]
+            reconcile = asyncio.create_task(self._reconcile(user))
+            self._reconciling.add(reconcile)
+            reconcile.add_done_callback(self._reconciling.discard)
+            return
+
+        task = asyncio.create_task(self._apply_later(user, is_online))
+        self._pending[user.id] = (is_online, task)
+
+    async def _apply_later(self, user, is_online):
+        await asyncio.sleep(self.grace_period)
+        del self._pending[user.id]
+        try:
+            await self.apply(user, is_online)
+        except Exception:
+            logger.exception("Applying presence change for user %s failed", user.id)
+
+    def is_pending(self, user_id):
+        """Whether a change of the user's status is being held back."""
+        return user_id in self._pending
+
+    async def _reconcile(self, user):
+        try:
+            connections = await presence_registry.members(user.id)
+            await self.apply(user, bool(connections[user.id]))
+        except Exception:
+            logger.exception("Reconciling presence of user %s failed", user.id)
+
+    async def apply(self, user, is_online):
+        """
+        Write and publish a change now, if the user's connections still agree.
+
+        Returns:
+            True if the change was written
+        """
+        connections = await presence_registry.members(user.id)
+        if bool(connections[user.id]) != is_online:
+            return False
+        if not await set_online_flag(user, is_online):
+            return False
+
+        await publish_presence(user.id, is_online)
+        return True
+
+
+presence_aggregator = PresenceAggregator(settings.CHAT_PRESENCE_GRACE_PERIOD)
+
+
+async def sweep_presence():
+    """
+    Take users offline who are marked online but have no live connection.
+
+    Online users are checked SWEEP_BATCH_SIZE at a time, with one registry
+    lookup per batch.
+
+    Returns:
+        IDs of the users that were taken offline
+    """
+    swept = []
+    online = CustomUser.objects.filter(is_online=True).only("id").order_by("id")
+    last_id = 0
+    while batch := [user async for user in online.filter(id__gt=last_id)[:SWEEP_BATCH_SIZE]]:
+        last_id = batch[-1].id
+        # A held change decides; sweeping now would race a reconnect
+        users = [user for user in batch if not presence_aggregator.is_pending(user.id)]
+        connections = await presence_registry.members_many([user.id for user in users])
+        for user in users:
+            if connections[user.id][user.id]:
+                continue
+            if await set_online_flag(user, False):
+                await publish_presence(user.id, False)
+                swept.append(user.id)
+    return swept
+
+
+class PresenceSweeper:
+    """
+    Runs sweep_presence every `interval` seconds once started.
+
+    Every worker runs one, but the registry hands each interval's sweep
+    to a single process.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        """Start sweeping on the running event loop, unless already running there."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Presence sweep failed")
+
+    async def sweep(self):
+        """Sweep, unless another process already has this interval's sweep."""
+        if not await presence_registry.claim("sweep", self.interval):
+            return None
+        return await sweep_presence()
+
+
+presence_sweeper = PresenceSweeper(settings.CHAT_CONNECTION_TTL)
@@ -1,31 +1,41 @@
-from channels.db import database_sync_to_async
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from accounts.models import CustomUser
+from chat.broadcast_utils import get_channel
 
-@database_sync_to_async
-def update_user_online_status(user, is_online):
+
+def presence_group(user_id):
+    """Channel group of the connections subscribed to a user's presence."""
+    return f"presence_{user_id}"
+
+
+async def publish_presence(user_id, is_online):
+    """Send a status change to the connections subscribed to the user."""
+    await get_channel().group_send(presence_group(user_id), {
+        "type": "presence.change",
+        "user_id": user_id,
+        "is_online": is_online,
+    })
+
+
+async def set_online_flag(user, is_online):
+    """
+    Write the user's is_online flag, and nothing else, if it changes.
+
+    Concurrent callers (other workers, the presence sweep) race on the
+    conditional update, so only one of them sees the change.
+
+    Returns:
+        True if the flag changed
+    """
+    changed = await CustomUser.objects.filter(pk=user.pk).exclude(
+        is_online=is_online).aupdate(is_online=is_online)
     user.is_online = is_online
-    user.save()
-
-    channel_layer = get_channel_layer()
-
-    # Get all rooms this user is part of with pre-fetched users
-    rooms = user.chat_rooms.prefetch_related('users').all()
-    notified_users = set()
-
-    for room in rooms:
-        for other_user in room.users.all():
-            if other_user != user and other_user.id not in notified_users:
-                # Send notification to this user
-                async_to_sync(channel_layer.group_send)(
-                    f"notification_{other_user.id}",
-                    {
-                        "type": "notify",
-                        "data": {
-                            "event": "status_change",
-                            "user_id": user.id,
-                            "is_online": is_online
-                        }
-                    }
-                )
-                notified_users.add(other_user.id)
+    return bool(changed)
+
+
+async def update_user_online_status(user, is_online):
+    """Store the user's online flag and publish it straight away, if it changed."""
+    if not await set_online_flag(user, is_online):
+        return False
+
+    await publish_presence(user.id, is_online)
+    return True